@@ -7,7 +7,9 @@ import argparse
 from urllib.parse import urlparse
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 DOC_STRING = """
 Usage:
@@ -15,6 +17,10 @@ Usage:
 """
 exclude_artists = 0
 include_rank = 0
+# At most this many yt-dlp and ffmpeg processes run at once with --jobs. Set by --processes
+subprocess_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+# With --jobs above 1 the output of yt-dlp and ffmpeg is only shown when they fail, so songs don't interleave
+quiet_subprocesses = False
 
 
 def normalizeTime(time_str):
@@ -73,10 +79,21 @@ def get_columns(sheet, isMp3):
     return (song_column, link_column, rank_column, start_column, end_column, artist_column)
 
 
+def run_process(command):
+    """Runs yt-dlp or ffmpeg, waiting for a free slot so only --processes of them run at once"""
+    with subprocess_slots:
+        result = subprocess.run(command, encoding='utf-8', capture_output=quiet_subprocesses)
+    if quiet_subprocesses and result.returncode != 0:
+        print(f"[WARN] {command[0]} failed for {command[-1]}:\n{result.stdout}{result.stderr}")
+    return result
+
+
 def dl_song(hostname, link, file_name, isMp3, start_time, end_time):
+    """Downloads and trims one song. Returns False if a step failed"""
     if hostname in ["www.youtube.com", "youtu.be", "music.youtube.com"]:
         if isMp3:
-            file = subprocess.run([
+            out_path = None
+            file = run_process([
                 "yt-dlp",
                 "--encoding", "utf-8",
                 "--no-playlist",
@@ -84,10 +101,10 @@ def dl_song(hostname, link, file_name, isMp3, start_time, end_time):
                 "--extract-audio",
                 "-o", file_name,
                 link
-            ], encoding='utf-8')
+            ])
         else:
             out_path = f"{file_name}.mp4"
-            file = subprocess.run([
+            file = run_process([
                 "yt-dlp",
                 "--encoding", "utf-8",
                 "--no-playlist",
@@ -95,7 +112,9 @@ def dl_song(hostname, link, file_name, isMp3, start_time, end_time):
                 "--merge-output-format", "mp4",
                 "-o", out_path,
                 link
-            ], encoding='utf-8')
+            ])
+        if file.returncode != 0:
+            return False
 
     elif hostname in ["files.catbox.moe", "openings.moe", "ladist1.catbox.video", "naedist.animemusicquiz.com", "nawdist.animemusicquiz.com", "eudist.animemusicquiz.com"]:
         print(link)
@@ -103,27 +122,68 @@ def dl_song(hostname, link, file_name, isMp3, start_time, end_time):
             'User-agent': 'Mozilla/5.0'
         }
         response = requests.get(link, headers=headers)
+        if not response.ok:
+            print(f"[WARN] Download failed with status {response.status_code}: {link}")
+            return False
         extension = link.split(".")[-1]
         out_path = f"{file_name}.{extension}" if not isMp3 else f"{file_name}.mp3"
         with open(out_path, "wb") as file:
             file.write(response.content)
-        result = subprocess.run(
-            ['ffmpeg', '-i', out_path, "-c", "copy", "-metadata", 'title='])
+        base, ext = os.path.splitext(out_path)
+        tmp_path = base + ".tmp" + ext
+        result = run_process(
+            ['ffmpeg', '-y', '-i', out_path, "-c", "copy", "-metadata", 'title=', tmp_path])
         if result.returncode != 0:
             print(f"ffmpeg failed with code {result.returncode}")
-            return
+            return False
+        os.replace(tmp_path, out_path)
     else:
         print("Hostname not recognized", hostname, file_name)
         sys.stdout.flush()
-    if start_time is not None and end_time is not None and os.path.exists(out_path):
+        return False
+    if start_time is not None and end_time is not None and out_path is not None and os.path.exists(out_path):
         base, ext = os.path.splitext(out_path)
         tmp_path = base + ".tmp" + ext
-        result = subprocess.run(
-            ['ffmpeg',  '-i', out_path, '-ss', str(start_time), "-to", str(end_time), "-c", "copy", tmp_path])
+        result = run_process(
+            ['ffmpeg', '-y', '-i', out_path, '-ss', str(start_time), "-to", str(end_time), "-c", "copy", tmp_path])
+        if result.returncode != 0:
+            return False
         os.replace(tmp_path, out_path)
+    return True
+
+
+def dl_all(songs, isMp3, jobs):
+    """Downloads songs, a list of (host name, link, file name, start time, end time) in sheet order,
+    jobs at a time, and prints how each one went in that order"""
+    # Two rows with the same file name would be written at the same time. The last one won when downloading one by one
+    by_file = {}
+    for song in songs:
+        if song[2] in by_file:
+            print(f"[WARN] {song[2]} is in the sheet more than once, only the last one is kept")
+        by_file[song[2]] = song
+    songs = [song for song in songs if by_file[song[2]] is song]
+
+    def download(song):
+        host_name, link, file_name, start_time, end_time = song
+        start = time.perf_counter()
+        try:
+            ok = dl_song(host_name, link, file_name, isMp3, start_time, end_time)
+        except Exception as e:
+            print(f"[WARN] Could not download {file_name}: {e!r}")
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(download, songs))
+    failed = [song[2] for song, (ok, _) in zip(songs, results) if not ok]
+    print(f"[INFO] Downloaded {len(songs) - len(failed)} of {len(songs)} songs in {time.perf_counter() - start:.1f} s "
+          f"({sum(seconds for _, seconds in results):.1f} s of downloading with {jobs} at a time)")
+    for file_name in failed:
+        print(f"[WARN] Failed: {file_name}")
 
 
-def dl_ranks_mp3(file_name, index):
+def dl_ranks_mp3(file_name, index, jobs=1):
     folder = os.path.splitext(file_name)[0]
     if not os.path.exists(folder):
         os.mkdir(folder)
@@ -133,11 +193,12 @@ def dl_ranks_mp3(file_name, index):
     song_column, link_column, rank_column, start_column, end_column, artist_column = get_columns(
         sheet, True)
 
+    songs = []
     for row in sheet.iter_rows(min_row=2):
         if row[0].value is None:
             print(
                 "[INFO] None detected. This could be an error or end of file. Exiting")
-            return
+            break
         song_name = row[song_column].value
         try:
             link = row[link_column].hyperlink.target
@@ -157,11 +218,11 @@ def dl_ranks_mp3(file_name, index):
         else:
             file_name = f"{folder}/{song_name}"
         host_name = urlparse(link).hostname
-        dl_song(host_name, link, file_name, isMp3=True,
-                start_time=start_time, end_time=end_time)
+        songs.append((host_name, link, file_name, start_time, end_time))
+    dl_all(songs, isMp3=True, jobs=jobs)
 
 
-def dl_vids(file_name, index):
+def dl_vids(file_name, index, jobs=1):
     folder = os.path.splitext(file_name)[0]
     if not os.path.exists(folder):
         os.mkdir(folder)
@@ -171,12 +232,12 @@ def dl_vids(file_name, index):
     song_column, link_column, _, start_column, end_column, artist_column = get_columns(
         sheet, False)
 
-    count = 2
+    songs = []
     for row in sheet.iter_rows(min_row=2):
         if row[0].value is None:
             print(
                 "[INFO] None detected. This could be an error or end of file. Exiting")
-            return
+            break
         song_name = row[song_column].value
         try:
             link = row[link_column].hyperlink.target
@@ -189,9 +250,8 @@ def dl_vids(file_name, index):
             row[start_column].value) if start_column is not None else None
         end_time = normalizeTime(
             row[end_column].value) if end_column is not None else None
-        dl_song(host_name, link, file_name, isMp3=False,
-                start_time=start_time, end_time=end_time)
-        count += 1
+        songs.append((host_name, link, file_name, start_time, end_time))
+    dl_all(songs, isMp3=False, jobs=jobs)
 
 
 if __name__ == '__main__':
@@ -203,6 +263,10 @@ if __name__ == '__main__':
                         'mp3', 'mp4'], default='mp3', help='Type to download. mp3 or mp4')
     parser.add_argument("-i", '--sheet_index', type=int,
                         default='0', help='Index of the sheet to read from')
+    parser.add_argument("-j", '--jobs', type=int, default=1,
+                        help='Number of songs to download at once. 1 downloads one by one')
+    parser.add_argument("-p", '--processes', type=int, default=None,
+                        help='Most yt-dlp and ffmpeg processes to run at once with --jobs. Defaults to the number of CPUs')
 
     args = parser.parse_args()
     command = args.mode
@@ -212,11 +276,14 @@ if __name__ == '__main__':
         exclude_artists = int(args.exclude_artist)
     if args.include_rank:
         include_rank = int(args.include_rank)
+    if args.processes:
+        subprocess_slots = threading.BoundedSemaphore(args.processes)
+    quiet_subprocesses = args.jobs > 1
 
     if command == 'mp4':
-        dl_vids(sheet, index)
+        dl_vids(sheet, index, args.jobs)
     elif command == 'mp3':
-        dl_ranks_mp3(sheet, index)
+        dl_ranks_mp3(sheet, index, args.jobs)
     else:
         print(DOC_STRING)
         exit()
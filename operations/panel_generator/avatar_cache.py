@@ -0,0 +1,83 @@
+import json
+import os
+import time
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+# Resample filter avatars are resized with. Pillow's default for resize
+AVATAR_RESAMPLE = Image.Resampling.BICUBIC
+
+
+class ThumbnailCache:
+    """Avatars already resized to one size, kept on disk between runs.
+    All thumbnails of a size are packed in one (count, size, size, 4) .npy file that is memory mapped,
+    so a hit costs a stat of the source image instead of decoding and resizing it.
+    Entries are keyed by source path, mtime, file size and resample filter"""
+    def __init__(self, cache_dir: str, size: int, resample: Image.Resampling = AVATAR_RESAMPLE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.resample = resample
+        self.index_path = os.path.join(cache_dir, f"avatars_{size}.json")
+        self.index = {"pack": None, "entries": {}}
+        self.pack: Optional[np.ndarray] = None
+        self.new_tiles: dict[str, np.ndarray] = {}
+        self.hits = 0
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    self.index = json.load(f)
+                self.pack = np.load(os.path.join(cache_dir, self.index["pack"]), mmap_mode="r")
+            except (OSError, ValueError, KeyError, TypeError):
+                print(f"[WARNING] Thumbnail cache {self.index_path} is unreadable, rebuilding it")
+                self.index = {"pack": None, "entries": {}}
+                self.pack = None
+
+    def get(self, path: str) -> Image.Image:
+        """RGBA thumbnail of the image at path. Raises FileNotFoundError if it doesn't exist"""
+        stat = os.stat(path)
+        key = [stat.st_mtime_ns, stat.st_size, int(self.resample)]
+        entry = self.index["entries"].get(path)
+        if path not in self.new_tiles and entry is not None and entry["key"] == key and self.pack is not None:
+            self.hits += 1
+            # Shares memory with the mapped pack, nothing is copied until the tile is pasted
+            return Image.frombuffer("RGBA", (self.size, self.size), self.pack[entry["slot"]], "raw", "RGBA", 0, 1)
+
+        with Image.open(path) as source:
+            tile = np.asarray(source.resize((self.size, self.size), self.resample).convert("RGBA"))
+        self.new_tiles[path] = tile
+        self.index["entries"][path] = {"key": key, "slot": None}
+        return Image.fromarray(tile, "RGBA")
+
+    def save(self) -> None:
+        """Writes a new pack if any thumbnail was added or changed, dropping entries whose source image is gone"""
+        if not self.new_tiles:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tiles = []
+        entries = {}
+        for path, entry in self.index["entries"].items():
+            if path in self.new_tiles:
+                tiles.append(self.new_tiles[path])
+            elif self.pack is not None and entry["slot"] is not None and os.path.exists(path):
+                tiles.append(self.pack[entry["slot"]])
+            else:
+                continue
+            entries[path] = {"key": entry["key"], "slot": len(tiles) - 1}
+
+        pack_name = f"avatars_{self.size}_{time.time_ns()}.npy"
+        np.save(os.path.join(self.cache_dir, pack_name), np.stack(tiles))
+        old_pack = self.index["pack"]
+        self.index = {"pack": pack_name, "entries": entries}
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+        self.pack = np.load(os.path.join(self.cache_dir, pack_name), mmap_mode="r")
+        self.new_tiles = {}
+        if old_pack is not None:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_pack))
+            except OSError:
+                # Still mapped by this or another process on Windows
+                pass
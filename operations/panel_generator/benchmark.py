@@ -0,0 +1,449 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+import numpy as np
+import openpyxl
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, so peak memory isn't recorded there
+    resource = None
+
+import generate_panels
+import panels_seasons
+from panel_writer import PanelWriter
+from profiler import profiler
+from sheet_reader import iter_sheet_rows
+
+# Settings
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ["ranking", "scoring", "dartboard", "seasons"]
+RESULTS_PATH = "bench_results.jsonl"
+# Used in place of any font the scripts name that isn't in Fonts
+FALLBACK_FONT = "Montserrat-Regular.ttf"
+AVATAR_PIXELS = 512
+SEASONS = ["Winter", "Spring", "Summer", "Fall"]
+NAMES = ["Alpha", "Bravo", "Charlie", "Delta", "Echo", "Foxtrot", "Golf", "Hotel", "India", "Juliet", "Kilo", "Lima",
+         "Mike", "November", "Oscar", "Papa", "Quebec", "Romeo", "Sierra", "Tango", "Uniform", "Victor", "Whiskey",
+         "Xray", "Yankee", "Zulu"]
+WORDS = ["koi", "no", "yume", "sora", "hikari", "kaze", "tsubasa", "hoshi", "namida", "mirai", "kimi", "boku"]
+"""
+Renders synthetic sheets end to end in a scratch directory and appends the results to bench_results.jsonl.
+Only the fonts and templates in this folder are used, with placeholder avatars, so it runs offline.
+Compare two commits by running it on each and then --compare on the results file
+
+Usage:
+  python benchmark.py --rows 100 --rankers 16 --modes ranking dartboard --label my-change
+"""
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.symlink(source, destination)
+    except OSError:
+        # Symlinks need extra rights on Windows
+        shutil.copyfile(source, destination)
+
+
+def find_bundled(folder: str, name: str) -> Optional[str]:
+    """Path of name in one of this script's folders, ignoring case like Windows does"""
+    bundled = {entry.lower(): entry for entry in os.listdir(os.path.join(SCRIPT_DIR, folder))}
+    entry = bundled.get(name.lower())
+    return os.path.join(SCRIPT_DIR, folder, entry) if entry else None
+
+
+def stage_assets(work_dir: str) -> None:
+    """Links the bundled fonts and templates into work_dir under the relative paths the scripts open them by"""
+    sources = ""
+    for module in (generate_panels, panels_seasons):
+        with open(module.__file__, "r", encoding="utf-8") as f:
+            sources += f.read()
+    fonts = sorted(set(re.findall(r"Fonts/[\w.\-]+", sources)))
+    templates = sorted({generate_panels.BG_PATH, generate_panels.FRAME_PATH,
+                        panels_seasons.BG_PATH, panels_seasons.FRAME_PATH})
+
+    os.makedirs(os.path.join(work_dir, "Fonts"), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "Template"), exist_ok=True)
+    for font in fonts:
+        name = os.path.basename(font)
+        source = find_bundled("Fonts", name)
+        if source is None:
+            print(f"[WARNING] {name} is not bundled, using {FALLBACK_FONT} in its place")
+            source = find_bundled("Fonts", FALLBACK_FONT)
+        link_or_copy(source, os.path.join(work_dir, "Fonts", name))
+    for template in templates:
+        name = os.path.basename(template)
+        source = find_bundled("Template", name)
+        if source is None:
+            print(f"[WARNING] {name} is not bundled, using a placeholder frame in its place")
+            placeholder_frame().save(os.path.join(work_dir, "Template", name))
+        else:
+            link_or_copy(source, os.path.join(work_dir, "Template", name))
+
+
+def placeholder_frame() -> Image.Image:
+    frame = Image.new("RGBA", (1400, 800), (0, 0, 0, 0))
+    ImageDraw.Draw(frame).rectangle(((0, 0), (1399, 799)), fill=(20, 20, 20, 200), outline=(193, 193, 193), width=4)
+    return frame
+
+
+def make_avatars(work_dir: str, names: list[str], pixels: int, rng: random.Random) -> None:
+    folder = os.path.join(work_dir, "avatars")
+    os.makedirs(folder, exist_ok=True)
+    for name in names:
+        color = tuple(rng.randrange(256) for _ in range(3))
+        avatar = Image.new("RGBA", (pixels, pixels), color + (255,))
+        ImageDraw.Draw(avatar).ellipse((pixels // 4, pixels // 4, pixels * 3 // 4, pixels * 3 // 4), fill="white")
+        avatar.save(os.path.join(folder, f"{name}.png"))
+
+
+def make_title(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, words)))
+
+
+def make_sheet(path: str, mode: str, rows: int, rankers: list[str], title_words: int, rng: random.Random) -> None:
+    """Sheet generate_panels reads, plus the guesses sheet at index 1 for dartboard"""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["ID", "Anime", "Song Info", "Type", "Nominator", "Rank", "Total"] + rankers)
+    for index in range(rows):
+        if mode == "scoring":
+            scores = [rng.randint(1, 10) for _ in rankers]
+        else:
+            scores = [rng.randint(1, rows) for _ in rankers]
+        nominator = rankers[index % len(rankers)]
+        sheet.append([index + 1, make_title(rng, title_words), f"{make_title(rng, title_words)} by {make_title(rng, 2)}",
+                      rng.choice(["OP", "ED", "IN"]), nominator, index + 1, sum(scores) / len(scores)] + scores)
+    if mode == "dartboard":
+        guesses = workbook.create_sheet("Guesses")
+        guesses.append(["ID", "Nominator"] + rankers)
+        for index in range(rows):
+            guesses.append([index + 1, rankers[index % len(rankers)]] + [rng.choice(rankers) for _ in rankers])
+    workbook.save(path)
+
+
+def make_seasons_sheet(path: str, rows: int, title_words: int, rng: random.Random) -> None:
+    """Rows are consecutive seasons from Winter 2000, so every panel gets its own file name.
+    Every honorable mention gets placeholder album art in honorables next to the sheet"""
+    art_folder = os.path.join(os.path.dirname(path), "honorables")
+    os.makedirs(art_folder, exist_ok=True)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Year", "Season", "Anime", "Song Link", "Song Info", "Type", "Score",
+                  "OP", "ED", "IN", "Tokens", "Male", "Female", "Both", "Honorary"])
+    for index in range(rows):
+        honorable = f"{make_title(rng, title_words)} by {make_title(rng, 2)}" if rng.random() < 0.5 else None
+        if honorable:
+            # Own generator so the sheet stays the same as before album art was added
+            art_rng = random.Random(honorable)
+            art = Image.new("RGB", (300, 300), tuple(art_rng.randrange(256) for _ in range(3)))
+            art.save(os.path.join(art_folder, f"{honorable.split(' by ')[0]}.png"))
+        sheet.append([2000 + index // len(SEASONS), SEASONS[index % len(SEASONS)], make_title(rng, title_words),
+                      "http://localhost", f"{make_title(rng, title_words)} by {make_title(rng, 2)}",
+                      rng.choice(["OP", "ED", "IN"]), str(rng.randint(1, 10)),
+                      rng.randint(0, 9), rng.randint(0, 9), rng.randint(0, 9), rng.randint(0, 50),
+                      rng.randint(0, 9), rng.randint(0, 9), rng.randint(0, 9), honorable])
+    workbook.save(path)
+
+
+def prepare(work_dir: str, args) -> None:
+    # No digits (clean_name drops them) and nothing get_columns would take for another column
+    rankers = [NAMES[index % len(NAMES)] + ("" if index < len(NAMES) else chr(ord("A") + index // len(NAMES) - 1))
+               for index in range(args.rankers)]
+    stage_assets(work_dir)
+    make_avatars(work_dir, rankers + ["Potato"], args.avatar_pixels, random.Random(args.seed))
+    for mode in args.modes:
+        # Seeded per mode so a sheet is the same whichever other modes are benchmarked with it
+        rng = random.Random(f"{args.seed}-{mode}")
+        if mode == "seasons":
+            make_seasons_sheet(os.path.join(work_dir, "seasons.xlsx"), args.rows, args.title_words, rng)
+        else:
+            make_sheet(os.path.join(work_dir, f"{mode}.xlsx"), mode, args.rows, rankers, args.title_words, rng)
+
+
+def time_function(function, repeat: int) -> float:
+    """Best of repeat runs, in ms"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_generate_panels(mode: str, args) -> dict:
+    sheet = f"{mode}.xlsx"
+    panel_args = argparse.Namespace(
+        sheet=sheet, inside_box=args.inside_box, mode=mode, centered=False, single_sided="off",
+        dartboard=1 if mode == "dartboard" else None, auto_layout=args.auto_layout, workers=args.workers,
+        no_static_layer=False, format="png", compress_level=None, drop_alpha=False,
+        writer_threads=args.writer_threads, video=None, force=True, profile=f"trace_{mode}.json")
+    start = time.perf_counter()
+    generate_panels.main(panel_args)
+    seconds = time.perf_counter() - start
+    stages = profiler.summary()
+    profiler.enabled = False
+
+    # Single functions on one template, without the disk or the worker pool
+    template_details, template_panel = generate_panels.setup_panels(panel_args, "bench_functions", writer_threads=0)
+    rows = list(generate_panels.iter_song_rows(sheet))
+    row_stats = generate_panels.compute_row_stats(rows, template_details)
+    row = rows[0]
+    info_dict = template_details.info_dict
+    song_info = {
+        "song_name": row[info_dict["song_column"]],
+        "anime_name": row[info_dict["anime_column"]],
+        "song_type": row[info_dict["type_column"]],
+        "rank": row[info_dict["rank_column"]],
+        "total": row[info_dict["total_column"]]
+    }
+    panel = generate_panels.render_song_panel(row, template_details, template_panel, row_stats[0])
+    os.makedirs("bench_functions", exist_ok=True)
+    functions = {
+        "compute_row_stats": time_function(
+            lambda: generate_panels.compute_row_stats(rows, template_details), args.repeat),
+        "create_template": time_function(lambda: generate_panels.create_template(template_details), args.repeat),
+        "write_song_info": time_function(
+            lambda: generate_panels.write_song_info(song_info, template_panel.copy(), template_details), args.repeat),
+        "write_user_info": time_function(
+            lambda: generate_panels.write_user_info(row, int(row[info_dict["id_column"]]), template_panel.copy(),
+                                                    row[info_dict["nominator_column"]], template_details,
+                                                    row_stats[0]), args.repeat),
+        "render_song_panel": time_function(
+            lambda: generate_panels.render_song_panel(row, template_details, template_panel, row_stats[0]),
+            args.repeat),
+        "save_png": time_function(
+            lambda: template_details.writer.save(panel, os.path.join("bench_functions", "panel.png")), args.repeat),
+    }
+    return {"panels": len(rows), "seconds": seconds, "stages": stages, "functions_ms": functions}
+
+
+def run_seasons(args) -> dict:
+    start = time.perf_counter()
+    panels_seasons.main("seasons.xlsx", "trace_seasons.json", force=True)
+    seconds = time.perf_counter() - start
+    stages = profiler.summary()
+    profiler.enabled = False
+
+    rows = iter_sheet_rows("seasons.xlsx", None)
+    indices_info = panels_seasons.get_columns(next(rows))
+    row = next(rows)
+    rows.close()
+    template_details = panels_seasons.PanelInfo(indices_info, "bench_functions", "Potato")
+    template_details.writer = PanelWriter(threads=0)
+    template_panel = panels_seasons.create_template(template_details)
+    song_info = {key: row[index] for key, index in indices_info.items()}
+    os.makedirs("bench_functions", exist_ok=True)
+    functions = {
+        "create_template": time_function(lambda: panels_seasons.create_template(template_details), args.repeat),
+        "write_song_info": time_function(
+            lambda: panels_seasons.write_song_info(song_info, template_panel.copy(), template_details), args.repeat),
+        "write_count_info": time_function(
+            lambda: panels_seasons.write_count_info(song_info, template_panel.copy(), template_details), args.repeat),
+        "write_honorables": time_function(
+            lambda: panels_seasons.write_honorables(song_info, template_panel.copy(), template_details), args.repeat),
+        "save_png": time_function(
+            lambda: template_details.writer.save(template_panel, os.path.join("bench_functions", "panel.png")),
+            args.repeat),
+    }
+    panels = len([name for name in os.listdir(os.path.join("PR", "seasons", "panels")) if name.endswith(".png")])
+    return {"panels": panels, "seconds": seconds, "stages": stages, "functions_ms": functions}
+
+
+def run_case(mode: str, args) -> dict:
+    """Runs one mode in this process, which the parent started fresh so peak memory is this mode's alone"""
+    os.chdir(args.work_dir)
+    # Every case starts without resized avatars on disk
+    shutil.rmtree(generate_panels.AVATAR_CACHE_PATH, ignore_errors=True)
+    result = run_seasons(args) if mode == "seasons" else run_generate_panels(mode, args)
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    result["peak_worker_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    return result
+
+
+def check_static_layer(args) -> int:
+    """Renders every row of each generate_panels sheet with and without the baked avatar layer and returns how many
+    panels differ. Rankers get long names, so names run into the avatars next to them"""
+    rankers = [NAMES[index % len(NAMES)] + NAMES[(index + 1) % len(NAMES)] + NAMES[(index + 2) % len(NAMES)]
+               for index in range(args.rankers)]
+    os.chdir(args.work_dir)
+    stage_assets(args.work_dir)
+    make_avatars(args.work_dir, rankers, args.avatar_pixels, random.Random(args.seed))
+    differing = 0
+    for mode in [mode for mode in args.modes if mode != "seasons"]:
+        sheet = f"{mode}_long_names.xlsx"
+        make_sheet(sheet, mode, args.rows, rankers, args.title_words, random.Random(f"{args.seed}-{mode}"))
+        renders = []
+        for no_static_layer in (False, True):
+            panel_args = argparse.Namespace(
+                sheet=sheet, inside_box=args.inside_box, mode=mode, centered=False, single_sided="off",
+                dartboard=1 if mode == "dartboard" else None, auto_layout=args.auto_layout,
+                no_static_layer=no_static_layer)
+            template_details, template_panel = generate_panels.setup_panels(panel_args, "check_static_layer",
+                                                                            writer_threads=0)
+            rows = list(generate_panels.iter_song_rows(sheet))
+            row_stats = generate_panels.compute_row_stats(rows, template_details)
+            renders.append([np.asarray(generate_panels.render_song_panel(row, template_details, template_panel, stats))
+                            for row, stats in zip(rows, row_stats)])
+        mismatches = [index + 1 for index, (baked, drawn) in enumerate(zip(*renders)) if not np.array_equal(baked, drawn)]
+        if mismatches:
+            print(f"[WARNING] {mode}: static layer changes {len(mismatches)} of {len(rows)} panels, rows {mismatches}")
+        else:
+            print(f"[INFO] {mode}: static layer matches on all {len(rows)} panels")
+        differing += len(mismatches)
+    return differing
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def case_config(args) -> dict:
+    """Everything a result has to share with another to be compared"""
+    return {key: getattr(args, key) for key in
+            ["rows", "rankers", "title_words", "avatar_pixels", "inside_box", "auto_layout",
+             "workers", "writer_threads", "seed"]}
+
+
+def compare(results_path: str, label: str) -> None:
+    """Compares every case of the run labelled label with the run before it that used the same config"""
+    with open(results_path, "r", encoding="utf-8") as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    current = [result for result in results if result["label"] == label]
+    if not current:
+        print(f"[WARNING] No results labelled {label} in {results_path}")
+        return
+    print(f"{'Mode':<12}{'Baseline':<22}{'Panels/s':>10}{'Now':>10}{'Change':>9}")
+    for result in current:
+        earlier = [other for other in results[:results.index(result)]
+                   if other["mode"] == result["mode"] and other["config"] == result["config"]
+                   and other["label"] != label]
+        if not earlier:
+            print(f"{result['mode']:<12}{'none':<22}{'':>10}{result['panels_per_sec']:>10.2f}")
+            continue
+        baseline = earlier[-1]
+        change = result["panels_per_sec"] / baseline["panels_per_sec"] - 1
+        print(f"{result['mode']:<12}{baseline['label'][:21]:<22}{baseline['panels_per_sec']:>10.2f}"
+              f"{result['panels_per_sec']:>10.2f}{change:>+9.1%}")
+
+
+def main(args) -> None:
+    if args.case:
+        result = run_case(args.case, args)
+        with open(args.case_output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    keep = args.work_dir is not None
+    args.work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="panel_bench_"))
+    os.makedirs(args.work_dir, exist_ok=True)
+    if args.check_static_layer:
+        try:
+            differing = check_static_layer(args)
+        finally:
+            os.chdir(SCRIPT_DIR)
+            if not keep:
+                shutil.rmtree(args.work_dir, ignore_errors=True)
+        sys.exit(1 if differing else 0)
+
+    results_path = os.path.abspath(args.output)
+    label = args.label or git_commit() or datetime.datetime.now().isoformat(timespec="seconds")
+    print(f"[INFO] Generating {args.rows} rows x {args.rankers} rankers in {args.work_dir}")
+    prepare(args.work_dir, args)
+
+    try:
+        for mode in args.modes:
+            case_output = os.path.join(args.work_dir, f"result_{mode}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--case", mode, "--case_output", case_output,
+                       "--work_dir", args.work_dir, "--repeat", str(args.repeat),
+                       "--workers", str(args.workers), "--writer_threads", str(args.writer_threads),
+                       "--inside_box", str(args.inside_box)]
+            if args.auto_layout:
+                command.append("--auto_layout")
+            print(f"[INFO] Benchmarking {mode}")
+            subprocess.run(command, check=True, cwd=SCRIPT_DIR,
+                           stdout=None if args.verbose else subprocess.DEVNULL)
+            with open(case_output, "r", encoding="utf-8") as f:
+                result = json.load(f)
+
+            result["panels_per_sec"] = result["panels"] / result["seconds"]
+            record = {
+                "label": label,
+                "commit": git_commit(),
+                "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "mode": mode,
+                "config": case_config(args),
+                **result,
+            }
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"[INFO] {mode}: {result['panels']} panels in {result['seconds']:.2f} s, "
+                  f"{result['panels_per_sec']:.2f} panels/s, peak RSS {rss}")
+    finally:
+        if not keep:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+    print(f"[INFO] Results appended to {results_path}")
+    compare(results_path, label)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark panel rendering on synthetic sheets.')
+    parser.add_argument('--modes', type=str, nargs='+', choices=MODES, default=MODES, help='Renderers to benchmark')
+    parser.add_argument('--rows', type=int, default=40, help='Rows (panels) per sheet')
+    parser.add_argument('--rankers', type=int, default=12, help='Rankers (avatars) per sheet')
+    parser.add_argument('--title_words', type=int, default=6, help='Words in each song and anime title')
+    parser.add_argument('--avatar_pixels', type=int, default=AVATAR_PIXELS,
+                        help='Width and height of the placeholder avatar images before resizing')
+    parser.add_argument('--inside_box', type=int, default=0, help='Rankers inside the video box')
+    parser.add_argument('--auto_layout', action="store_true", help='Benchmark with --auto_layout')
+    parser.add_argument('--workers', type=int, default=1, help='Render processes for generate_panels')
+    parser.add_argument('--writer_threads', type=int, default=2, help='Panel writer threads for generate_panels')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each single function, the best is kept')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic sheets')
+    parser.add_argument('--label', type=str, default=None,
+                        help='Name of this run in the results file. Defaults to the current commit')
+    parser.add_argument('--output', type=str, default=RESULTS_PATH, help='JSON lines file results are appended to')
+    parser.add_argument('--compare', action="store_true",
+                        help='Only compare the run labelled --label with the earlier run of the same config')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help='Keep the synthetic sheets and panels here instead of a temporary folder')
+    parser.add_argument('--verbose', action="store_true", help='Show the renderers\' output')
+    parser.add_argument('--check_static_layer', action="store_true",
+                        help='Instead of timing, check that panels are the same with and without the baked avatar '
+                             'layer, with ranker names long enough to run into the next avatar')
+    parser.add_argument('--case', type=str, choices=MODES, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--case_output', type=str, default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.output, args.label or git_commit())
+    else:
+        main(args)
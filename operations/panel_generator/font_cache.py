@@ -0,0 +1,63 @@
+import functools
+from PIL import ImageFont
+
+# Max number of (path, size) fonts kept loaded. Title shrinking can touch a few dozen sizes per run
+FONT_CACHE_SIZE = 64
+# Max number of fitted strings remembered by fit_font and truncate_to_width
+FIT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(path: str, size: float) -> ImageFont.FreeTypeFont:
+    """Process-wide font registry so each font file and size is only parsed once.
+    The returned font is shared, so callers should not modify it"""
+    return ImageFont.truetype(path, size=size)
+
+
+def clear_font_cache() -> None:
+    """Forgets every loaded font and fitted string, for when a font file changes on disk"""
+    get_font.cache_clear()
+    _fit_font_size.cache_clear()
+    _truncate_to_width.cache_clear()
+
+
+def fit_font(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> ImageFont.FreeTypeFont:
+    """Largest version of font, at its current size less a whole number of points, that fits text in max_width.
+    Found by bisection and memoized per text, font and width"""
+    return get_font(font.path, _fit_font_size(text, font.path, font.size, max_width))
+
+
+def truncate_to_width(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> str:
+    """Longest prefix of text that fits in max_width"""
+    return _truncate_to_width(text, font.path, font.size, max_width)
+
+
+@functools.lru_cache(maxsize=FIT_CACHE_SIZE)
+def _fit_font_size(text: str, path: str, size: float, max_width: float) -> float:
+    if get_font(path, size).getlength(text) <= max_width:
+        return size
+    # Bisect on how many points to take off. lo never fits, hi is the smallest size we allow
+    lo, hi = 0, max(int(size - 1), 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if get_font(path, size - mid).getlength(text) <= max_width:
+            hi = mid
+        else:
+            lo = mid
+    return size - hi
+
+
+@functools.lru_cache(maxsize=FIT_CACHE_SIZE)
+def _truncate_to_width(text: str, path: str, size: float, max_width: float) -> str:
+    font = get_font(path, size)
+    if font.getlength(text) <= max_width:
+        return text
+    # lo always fits (the empty string does), hi never does
+    lo, hi = 0, len(text)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if font.getlength(text[:mid]) <= max_width:
+            lo = mid
+        else:
+            hi = mid
+    return text[:lo]
@@ -1,20 +1,46 @@
+import functools
+import glob
+import hashlib
 import itertools
 import os
 import math
 import re
+import sys
 import argparse
+import datetime
+import time
 from typing import Optional
-from collections.abc import Generator
-import openpyxl
+from collections import Counter, deque
+from collections.abc import Generator, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageChops
+from PIL import Image, ImageDraw, ImageFont
+from font_cache import clear_font_cache, get_font, fit_font, truncate_to_width
+from glyph_atlas import glyph_atlas
+from sheet_reader import iter_sheet_rows, read_header
+from panel_writer import FORMATS, PanelWriter, VideoWriter
+from avatar_cache import ThumbnailCache
+from manifest import file_stamps, load_manifest, remove_stale_panels, save_manifest
+from profiler import profiler, trace_path
+from panel_layout import PanelLayout, box_positions_path, frame_layout, load_box_positions
 
 
 # Settings. Change these to your liking
 BG_PATH = './Template/black.png'
 FRAME_PATH = './Template/frame_cropped.png'
 AVATAR_PATH = './avatars'
+# Resized avatars are kept here between runs
+AVATAR_CACHE_PATH = './avatars/.thumbnails'
 SAVE_PATH = "./PR"
+# Part of every panel's manifest hash. Bump it whenever a change to the drawing code changes how panels look,
+# otherwise rows that didn't change keep their panels from the old code
+RENDER_VERSION = 1
+# Seconds between checks for changed files in --watch
+WATCH_INTERVAL = 0.5
+# Rendered frames per worker that --video keeps waiting for ffmpeg at most
+VIDEO_QUEUE_SIZE = 2
+# Rows whose scores are analysed together in one NumPy pass
+ROW_STATS_BATCH = 64
 X_PAD = 25
 Y_PAD = 30
 MIN_EDGE_PADDING = 40
@@ -22,6 +48,24 @@ AVATAR_SIZE = 125
 NUM_COLS_PER_SIDE = 2
 WIDTH = 1920
 HEIGHT = 1090
+GLOW_WIDTH = 10
+# Every pixel setting and font size is multiplied by this. --preview lowers it
+RENDER_SCALE = 1
+# --preview writes its panels and contact sheet to this folder inside the panels folder
+PREVIEW_DIR = "preview"
+PREVIEW_RESAMPLE = Image.Resampling.BILINEAR
+
+# Candidates --auto_layout picks from. Avatars inside the video box take up at most LAYOUT_MAX_INSIDE_HEIGHT of its height.
+# adjust_frame narrows the video frame without changing its height, so it is never made narrower than the settings
+# above make it with avatars on both sides, which would squash the video
+LAYOUT_AVATAR_SIZES = range(60, 201, 5)
+LAYOUT_COLUMNS = range(1, 5)
+LAYOUT_X_PADS = (15, 20, 25, 30)
+LAYOUT_MAX_INSIDE = 6
+LAYOUT_SIDES = ("off", "left", "right")
+LAYOUT_MAX_INSIDE_HEIGHT = 0.25
+# The hand-tuned settings above, before --auto_layout or --preview change them. Each sheet is set up from these
+DEFAULT_LAYOUT_SETTINGS = (AVATAR_SIZE, NUM_COLS_PER_SIDE, X_PAD)
 
 # Where each box in the frame starts and ends based on pixel percentage. Hardcoded for this template
 RANK_POSITION = [(0.096969697, 0.023784902), (0.172727273, 0.119958635)]
@@ -38,9 +82,8 @@ TYPE_POSITION = [(0.785606061, 0.006204757), (0.995454545, 0.055842813)]
 - A column for each ranker with their name matching their avatar icon file name
 """
 
-global_guesses_dict = {}
 class Person:
-    def __init__(self, name: str, index: int, image: Image.Image):
+    def __init__(self, name: str, index: int, image: Optional[Image.Image]):
         self.full_name = name
         self.index = index
         self.avatar = image
@@ -53,21 +96,138 @@ class Person:
         return clean_name(self.full_name, AVATAR_SIZE + X_PAD * 2 - 5)
 
 
+class AvatarTile:
+    """Everything drawn for a person that doesn't change between rows: the avatar with its border
+    (and the dartboard score box) plus the stroked name. The name is kept as the stroke and fill masks
+    so pasting it blends exactly like drawing the text on the panel"""
+    def __init__(self, person: Person, name_font: ImageFont.FreeTypeFont, mode: str):
+        self.image = Image.new('RGBA', (AVATAR_SIZE + 1, AVATAR_SIZE + 1))
+        self.image.paste(person.avatar, (0, 0))
+        draw = ImageDraw.Draw(self.image)
+        if mode == 'dartboard':
+            draw.rectangle(
+                ((0, int(AVATAR_SIZE - (AVATAR_SIZE * 0.3))), (int(AVATAR_SIZE * 0.3), AVATAR_SIZE)),
+                fill=(0, 0, 0),
+                outline=(255, 255, 255), width=1
+            )
+        draw.rectangle(
+            ((0, 0), (AVATAR_SIZE, AVATAR_SIZE)),
+            outline=(193, 193, 193), width=1
+        )
+
+        # Render the name masks at the same sub-pixel position it has on the panel, shifted by a whole-pixel pad
+        name = person.print_name
+        name_pos = (AVATAR_SIZE / 2, 0)
+        left, top, right, bottom = draw.textbbox(
+            name_pos, name, font=name_font, stroke_width=2, anchor="mm")
+        pad_x, pad_y = max(0, -math.floor(left)) + 1, max(0, -math.floor(top)) + 1
+        size = (math.ceil(right) + pad_x + 1, math.ceil(bottom) + pad_y + 1)
+        self.name_offset = (-pad_x, -pad_y)
+        self.name_layers = []
+        for ink, stroke_width in (('black', 2), ('white', 0)):
+            mask = Image.new('L', size)
+            ImageDraw.Draw(mask).text(
+                (name_pos[0] + pad_x, name_pos[1] + pad_y), name, font=name_font, fill=255,
+                stroke_width=stroke_width, stroke_fill=255, anchor="mm")
+            self.name_layers.append((ink, mask))
+
+        # Every pixel the tile draws on, in the coordinates of bbox((0, 0))
+        left, top = min(0, self.name_offset[0]), min(0, self.name_offset[1])
+        box = self.bbox((0, 0))
+        self.footprint = Image.new('L', (box[2] - box[0], box[3] - box[1]))
+        self.footprint.paste(255, (-left, -top, -left + self.image.width, -top + self.image.height))
+        stroke_mask = self.name_layers[0][1].point(lambda value: 255 if value else 0)
+        self.footprint.paste(stroke_mask, (self.name_offset[0] - left, self.name_offset[1] - top), stroke_mask)
+
+    def bbox(self, pos: tuple[int, int]) -> tuple[int, int, int, int]:
+        x, y = pos
+        name_mask = self.name_layers[0][1]
+        name_x, name_y = x + self.name_offset[0], y + self.name_offset[1]
+        return (min(x, name_x), min(y, name_y),
+                max(x + self.image.width, name_x + name_mask.width),
+                max(y + self.image.height, name_y + name_mask.height))
+
+    def paste(self, panel: Image.Image, pos: tuple[int, int]) -> None:
+        panel.paste(self.image, pos)
+        self.paste_name(panel, pos)
+
+    def clear(self, panel: Image.Image, pos: tuple[int, int], base: Image.Image) -> None:
+        """Restores every pixel this tile draws on to what it is in base"""
+        box = self.bbox(pos)
+        panel.paste(base.crop(box), box[:2], self.footprint)
+
+    def paste_name(self, panel: Image.Image, pos: tuple[int, int]) -> None:
+        x, y = pos[0] + self.name_offset[0], pos[1] + self.name_offset[1]
+        for ink, mask in self.name_layers:
+            panel.paste(ink, (x, y, x + mask.width, y + mask.height), mask)
+
+
 class FontStyles:
     @staticmethod
     def load_fonts():
         return {
-            "song": ImageFont.truetype("Fonts/Montserrat-Regular.ttf", size=30),
-            "anime": ImageFont.truetype("Fonts/Montserrat-Regular.ttf", size=30),
-            "type": ImageFont.truetype("Fonts/Montserrat-Regular.ttf", size=24),
-            "rank": ImageFont.truetype("Fonts/Montserrat-Regular.ttf", size=72.5),
-            "total": ImageFont.truetype("Fonts/Montserrat-Regular.ttf", size=52),
-            "name": ImageFont.truetype("Fonts/antipasto.regular.ttf", size=30),
-            "score": ImageFont.truetype("Fonts/SEANSBU.ttf", size=36),
-            "guess": ImageFont.truetype("Fonts/antipasto.regular.ttf", size=26)
+            "song": get_font("Fonts/Montserrat-Regular.ttf", 30 * RENDER_SCALE),
+            "anime": get_font("Fonts/Montserrat-Regular.ttf", 30 * RENDER_SCALE),
+            "type": get_font("Fonts/Montserrat-Regular.ttf", 24 * RENDER_SCALE),
+            "rank": get_font("Fonts/Montserrat-Regular.ttf", 72.5 * RENDER_SCALE),
+            "total": get_font("Fonts/Montserrat-Regular.ttf", 52 * RENDER_SCALE),
+            "name": get_font("Fonts/antipasto.regular.ttf", 30 * RENDER_SCALE),
+            "score": get_font("Fonts/SEANSBU.TTF", 36 * RENDER_SCALE),
+            "guess": get_font("Fonts/antipasto.regular.ttf", 26 * RENDER_SCALE)
         }
 
 
+class AssetPool:
+    """Background, frame and avatar images decoded once per process and shared by every sheet rendered in it.
+    Avatars are kept resized per size, so sheets with the same layout share them as well,
+    and come from the on-disk thumbnail cache when their source image hasn't changed"""
+    def __init__(self):
+        self.images = {}
+        self.avatars = {}
+        self.thumbnails: dict[int, ThumbnailCache] = {}
+
+    def image(self, path: str) -> Image.Image:
+        if path not in self.images:
+            image = Image.open(path)
+            image.load()
+            self.images[path] = image
+        return self.images[path]
+
+    def scaled(self, path: str, scale: float) -> Image.Image:
+        """The image at path resized by scale, for --preview"""
+        if scale == 1:
+            return self.image(path)
+        key = (path, scale)
+        if key not in self.images:
+            image = self.image(path)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            self.images[key] = image.resize(size, PREVIEW_RESAMPLE)
+        return self.images[key]
+
+    def avatar(self, name: str, size: int) -> Image.Image:
+        """Raises FileNotFoundError if the person has no avatar"""
+        key = (name, size)
+        if key not in self.avatars:
+            if size not in self.thumbnails:
+                self.thumbnails[size] = ThumbnailCache(AVATAR_CACHE_PATH, size)
+            self.avatars[key] = self.thumbnails[size].get(os.path.join(AVATAR_PATH, f"{name}.png"))
+        return self.avatars[key]
+
+    def forget(self, paths: set[str]) -> None:
+        """Drops the images loaded from paths, for when they change on disk"""
+        self.images = {key: image for key, image in self.images.items()
+                       if (key[0] if isinstance(key, tuple) else key) not in paths}
+        self.avatars = {key: avatar for key, avatar in self.avatars.items()
+                        if os.path.join(AVATAR_PATH, f"{key[0]}.png") not in paths}
+
+    def save_thumbnails(self) -> None:
+        for cache in self.thumbnails.values():
+            cache.save()
+
+
+asset_pool = AssetPool()
+
+
 class PanelConfig:
     def __init__(self,
                  mode: str,
@@ -76,19 +236,35 @@ class PanelConfig:
                  save_path: str,
                  centered: bool,
                  single_sided: bool,
-                 guesses_dict):
+                 guesses,
+                 static_layer: bool = True):
         self.mode = mode
         self.info_dict = info_dict
         self.base_path = save_path
         self.centered = centered
         self.single_sided = single_sided
         self.fonts = FontStyles.load_fonts()
-        self.background = Image.open(BG_PATH)
-        self.video_frame = Image.open(FRAME_PATH)
-        self.guesses_dict = guesses_dict
+        # Scores are drawn from pre-rendered glyphs
+        self.score_atlas = glyph_atlas(self.fonts["score"].path, self.fonts["score"].size, 2)
+        self.background = asset_pool.scaled(BG_PATH, RENDER_SCALE)
+        self.video_frame = asset_pool.scaled(FRAME_PATH, RENDER_SCALE)
+        self.guesses: Optional[GuessesIndex] = guesses
+        # Layout settings this sheet was set up with, put back by use_sheet when sheets share a process
+        self.layout_settings = (AVATAR_SIZE, NUM_COLS_PER_SIDE, X_PAD)
+        self.box_positions = load_box_positions(
+            FRAME_PATH, {"rank": RANK_POSITION, "total": TOTAL_POSITION, "type": TYPE_POSITION})
+        # Built by build_layout once the frame is sized and the avatars are placed
+        self.layout: Optional[PanelLayout] = None
         self.people = people
+        self.avatar_tiles = [AvatarTile(person, self.fonts["name"], mode) for person in people]
         self.avatars = len(people)
         self.avatar_positions = None
+        self.static_layer = static_layer
+        self.static_layer_time = 0.0
+        self.writer = PanelWriter(threads=0)
+        # Which avatar tiles create_template drew into the template, and the template without them
+        self.baked_tiles = [False] * len(people)
+        self.base_template = None
 
     @property
     def offset(self) -> tuple[int, int]:
@@ -111,8 +287,9 @@ class PanelConfig:
         self,
         space: tuple[int, int, int, int],
         count: int,
-        cols=NUM_COLS_PER_SIDE
+        cols=None
     ) -> Generator[tuple[int, int]]:
+        cols = NUM_COLS_PER_SIDE if cols is None else cols
         if count != 0:
             left, right, top, bottom = space
             num_total_rows = int(math.ceil(count / cols))
@@ -179,6 +356,83 @@ class PanelConfig:
             avatar_positions_inside))
 
 
+class GuessesIndex:
+    """Dartboard guesses as a (songs x people) array in the order of PanelConfig.people, so the hot loop
+    only indexes arrays. correct is filled in by validate, which needs the nominators from the main sheet"""
+    def __init__(self, ids: list[int], guesses: list[list], missing_rankers: list[str]):
+        self.rows = {song_id: index for index, song_id in enumerate(ids)}
+        self.duplicate_ids = sorted(song_id for song_id, count in Counter(ids).items() if count > 1)
+        self.missing_rankers = missing_rankers
+        # Guesses repeat the same few names, so every cell shares one string per name. Empty cells are ""
+        self.guesses = np.array([[sys.intern("" if guess is None else str(guess)) for guess in row] for row in guesses],
+                                dtype=object).reshape(len(ids), -1)
+        self.empty = np.array([[guess is None for guess in row] for row in guesses], dtype=bool).reshape(len(ids), -1)
+        self.correct = np.zeros(self.guesses.shape, dtype=bool)
+
+    def validate(self, songs: Iterable[tuple[int, Optional[str]]], people: list[Person]) -> None:
+        """Checks every (song ID, nominator) of the main sheet has guesses from every ranker and works out
+        which guesses are right. Raises ValueError before any panel is rendered if a song or ranker is missing"""
+        problems = []
+        if self.duplicate_ids:
+            print(f"[WARNING] IDs {self.duplicate_ids} are in the guesses sheet more than once, using their last row")
+        if self.missing_rankers:
+            problems.append(f"Rankers {self.missing_rankers} have no column in the guesses sheet")
+        missing_ids = []
+        for song_id, nominator in songs:
+            row = self.rows.get(song_id)
+            if row is None:
+                missing_ids.append(song_id)
+                continue
+            self.correct[row] = (self.guesses[row] == str(nominator)) & ~self.empty[row]
+            # The nominator doesn't guess their own song
+            blank = [person.full_name for person, empty in zip(people, self.empty[row])
+                     if empty and person.full_name.lower() != str(nominator).lower()
+                     and person.full_name not in self.missing_rankers]
+            if blank:
+                print(f"[WARNING] No guess from {', '.join(blank)} for song ID {song_id}")
+        if missing_ids:
+            problems.append(f"Song IDs {missing_ids} are not in the guesses sheet")
+        if problems:
+            raise ValueError("Dartboard guesses don't match the sheet: " + "; ".join(problems))
+
+    def row(self, song_id: int) -> int:
+        return self.rows[song_id]
+
+
+class RowStats:
+    """Everything write_user_info needs to know about one row's scores, one entry per person"""
+    def __init__(self, scores: list[str], colors: list, glows: list, nominators: list[bool]):
+        self.scores = scores
+        self.colors = colors
+        self.glows = glows
+        self.nominators = nominators
+
+
+class SheetStats:
+    """Per-ranker totals across the whole sheet, gathered while the row stats are computed"""
+    def __init__(self, people: list[Person]):
+        self.names = [person.full_name for person in people]
+        self.total = np.zeros(len(people))
+        self.count = np.zeros(len(people), dtype=int)
+        self.lowest = np.zeros(len(people), dtype=int)
+        self.highest = np.zeros(len(people), dtype=int)
+
+    def update(self, values: np.ndarray, valid: np.ndarray, is_low: np.ndarray, is_high: np.ndarray) -> None:
+        self.total += np.where(valid, values, 0).sum(axis=0)
+        self.count += valid.sum(axis=0)
+        self.lowest += is_low.sum(axis=0)
+        self.highest += is_high.sum(axis=0)
+
+    def report(self) -> None:
+        if not self.count.any():
+            return
+        print("[INFO] Sheet statistics (nominators excluded)")
+        print(f"{'Ranker':<20}{'Songs':>7}{'Average':>9}{'Lowest':>8}{'Highest':>9}")
+        average = np.divide(self.total, self.count, out=np.full(len(self.total), np.nan), where=self.count > 0)
+        for name, count, avg, lowest, highest in zip(self.names, self.count, average, self.lowest, self.highest):
+            print(f"{name:<20}{count:>7}{avg:>9.2f}{lowest:>8}{highest:>9}")
+
+
 def create_dirs(sheet_name: str) -> str:
     base_filename = os.path.splitext(os.path.basename(sheet_name))[0]
     save_path = os.path.join(SAVE_PATH, base_filename, "panels")
@@ -186,7 +440,7 @@ def create_dirs(sheet_name: str) -> str:
     return save_path
 
 
-def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> tuple[dict, list[Person]]:
+def get_columns(header: tuple) -> tuple[dict, list[Person]]:
     info_dict = {
         "anime_column": None,
         "song_column": None,
@@ -194,11 +448,11 @@ def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> tuple[dict, li
         "rank_column": None,
         "total_column": None,
         "nominator_column": None,
-        "id_column": None
+        "id_column": None,
+        "duration_column": None
     }
     people = []
-    for index, cell in enumerate(sheet[1]):
-        column = cell.value
+    for index, column in enumerate(header):
         if column:
             if info_dict["anime_column"] is None and "anime" in column.lower():
                 info_dict["anime_column"] = index
@@ -212,57 +466,129 @@ def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> tuple[dict, li
                 info_dict["total_column"] = index
             elif info_dict["nominator_column"] is None and "nominator" in column.lower():
                 info_dict["nominator_column"] = index
+            elif info_dict["duration_column"] is None and "duration" in column.lower():
+                info_dict["duration_column"] = index
             elif info_dict["id_column"] is None and "id" in column.lower():
                 info_dict["id_column"] = index
             elif info_dict["total_column"]:
-                try:
-                    path = os.path.join(AVATAR_PATH, f"{column}.png")
-                    avatar = Image.open(path).resize(
-                        (AVATAR_SIZE, AVATAR_SIZE))
-                    people.append(Person(column, index, avatar))
-                except FileNotFoundError:
-                    print(f"[WARNING] Could not find image for {column}")
-                    img = Image.new(
-                        'RGBA', (AVATAR_SIZE, AVATAR_SIZE), (0, 0, 0, 255))
-                    people.append(Person(column, index, img))
+                people.append(Person(column, index, None))
     return (info_dict, people)
 
-def create_guesses_dict(wrkbk, dartboard_index: int):
-    sheet = wrkbk.worksheets[dartboard_index]
+
+def load_avatars(people: list[Person]) -> None:
+    """Loads every person's avatar at AVATAR_SIZE. Done after the layout is settled since that can change the size"""
+    for person in people:
+        try:
+            person.avatar = asset_pool.avatar(person.full_name, AVATAR_SIZE)
+        except FileNotFoundError:
+            print(f"[WARNING] Could not find image for {person.full_name}")
+            person.avatar = Image.new(
+                'RGBA', (AVATAR_SIZE, AVATAR_SIZE), (0, 0, 0, 255))
+    asset_pool.save_thumbnails()
+
+def song_key(value) -> Optional[int]:
+    """Song IDs as ints, whether the cell holds 3, 3.0 or "3" """
+    if value is None or value == "":
+        return None
+    return int(float(value))
+
+
+def create_guesses_index(sheet_name: str, dartboard_index: int, people: list[Person]) -> GuessesIndex:
+    rows = iter_sheet_rows(sheet_name, dartboard_index)
     people_index_dict = {}
-    guesses_dict = {}
     id_column = None
 
-    for index, cell in enumerate(sheet[1]):
-        column = cell.value
+    for index, column in enumerate(next(rows, ())):
         if column == None:
             break
         elif id_column is None and "id" in column.lower():
             id_column = index
         elif column.lower() not in ["id", "nominator", "song name", "artist"]:
-            people_index_dict[index] = column
-
-    for index, row in enumerate(sheet.iter_rows(min_row=2, values_only=True)):
-        song_id = row[id_column]
-        guesses_dict[song_id] = {}
-        for person_index, name in people_index_dict.items():
-            guesses_dict[song_id][name] = row[person_index]
-    return guesses_dict
+            people_index_dict[column] = index
+    if id_column is None:
+        rows.close()
+        raise ValueError(f"Guesses sheet {dartboard_index} of {sheet_name} has no ID column")
+
+    ids = []
+    guesses = []
+    for row in rows:
+        song_id = song_key(row[id_column])
+        if song_id is None:
+            continue
+        ids.append(song_id)
+        guesses.append([row[people_index_dict[person.full_name]] if person.full_name in people_index_dict else None
+                        for person in people])
+    missing_rankers = [person.full_name for person in people if person.full_name not in people_index_dict]
+    return GuessesIndex(ids, guesses, missing_rankers)
 
 def create_template(template_details: PanelConfig) -> Image.Image:
     template_image = Image.new('RGBA', template_details.background.size)
     template_image.paste(template_details.background)
-    template_image.paste(template_details.video_frame, template_details.offset)
+    layout = template_details.layout
+    template_image.paste(template_details.video_frame, layout.offset)
+
+    if template_details.static_layer:
+        # Avatars, borders and names are the same on every panel, so draw them once here.
+        # Avatars that the song titles, rank, total or type can be drawn over are left out, since those go on top of them.
+        # So are avatars whose name runs into another avatar, its glow or its guess, since per panel those are drawn
+        # in order over and under each other, and a glowing baked avatar is cleared back to the bare template.
+        # The time this takes is roughly what each panel no longer has to spend on them
+        bg_w, bg_h = layout.background_size
+        offset = layout.offset
+        frame_pos = layout.frame_pos
+        title_height = max(template_details.fonts["song"].size, template_details.fonts["anime"].size)
+        song_info_regions = [
+            (0, 0, bg_w, max(frame_pos[2], offset[1] / 2 + title_height)),
+            (0, min(frame_pos[3], layout.anchors["anime"][1] - title_height), bg_w, bg_h),
+            (frame_pos[0], frame_pos[2], frame_pos[1] + 1, frame_pos[3] + 1),
+        ]
+        glow_size = AVATAR_SIZE + GLOW_WIDTH * 2
+        slot_regions = [[tile.bbox(pos), (x, y, x + glow_size, y + glow_size)] for tile, pos, (x, y) in zip(
+            template_details.avatar_tiles, layout.avatar_slots, layout.slot_anchors["glow"])]
+        # Guesses are drawn middle anchored with a 2 px stroke
+        ascender, descender = template_details.fonts["guess"].getmetrics()
+        half_height = (ascender + descender) / 2 + 2
+        for regions, ((guess_x, guess_y), guess_width) in zip(slot_regions, layout.slot_anchors.get("guess", ())):
+            regions.append((guess_x - 2, guess_y - half_height, guess_x + guess_width + 2, guess_y + half_height))
+        template_details.base_template = template_image.copy()
+        start = time.perf_counter()
+        for index, (tile, pos) in enumerate(zip(template_details.avatar_tiles, layout.avatar_slots)):
+            box = tile.bbox(pos)
+            other_regions = [region for other, regions in enumerate(slot_regions) if other != index for region in regions]
+            if not any(boxes_overlap(box, region) for region in song_info_regions + other_regions):
+                tile.paste(template_image, pos)
+                template_details.baked_tiles[index] = True
+        template_details.static_layer_time = time.perf_counter() - start
 
     return template_image
 
 
+def boxes_overlap(a: tuple, b: tuple) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
 def create_song_panel(
     row: tuple,
     template_details: PanelConfig,
     template_panel: Image.Image,
+    row_stats: Optional[RowStats] = None,
 ) -> None:
+    with profiler.stage("render"):
+        panel = render_song_panel(row, template_details, template_panel, row_stats)
+    save_path = os.path.join(template_details.base_path,
+                             panel_filename(row, template_details.info_dict, template_details.writer.extension))
+    template_details.writer.save(panel, save_path)
+
+
+def render_song_panel(
+    row: tuple,
+    template_details: PanelConfig,
+    template_panel: Image.Image,
+    row_stats: Optional[RowStats] = None,
+) -> Image.Image:
     info_dict = template_details.info_dict
+    if row_stats is None:
+        row_stats = compute_row_stats([row], template_details)[0]
     panel = template_panel.copy()
     song_info = {
         "song_name": row[info_dict["song_column"]],
@@ -279,169 +605,108 @@ def create_song_panel(
     else:
         nominator = row[info_dict["nominator_column"]]
 
-    write_song_info(song_info, panel, template_details)
-    write_user_info(row, int(row[info_dict["id_column"]]), panel, nominator, template_details)
+    with profiler.stage("song info"):
+        write_song_info(song_info, panel, template_details)
+    with profiler.stage("user info"):
+        write_user_info(row, song_key(row[info_dict["id_column"]]), panel, nominator, template_details, row_stats)
+    return panel
 
-    save_path = os.path.join(template_details.base_path,
-                             f"panel_{int(song_info['rank'])}.png")
-    panel.save(save_path)
+
+def panel_filename(row: tuple, info_dict: dict, extension: str = "png") -> str:
+    return f"panel_{int(row[info_dict['rank_column']])}.{extension}"
 
 
 def write_song_info(song_info: dict, panel: Image.Image, template_details: PanelConfig) -> None:
-    offset = template_details.offset
-    bg_w, bg_h = template_details.background.size
-    vf_w, vf_h = template_details.video_frame.size
+    layout = template_details.layout
+    offset = layout.offset
+    vf_w, vf_h = layout.frame_size
 
     song_name = str(song_info["song_name"])
     anime_name = str(song_info["anime_name"])
     rank = str(int(song_info["rank"]))
 
-    val = song_info["total"]
-    total = str(int(val) if val.is_integer() else f"{float(val):.1f}")
+    val = float(song_info["total"])
+    total = str(int(val) if val.is_integer() else f"{val:.1f}")
 
     song_font = template_details.fonts["song"]
     anime_font = template_details.fonts["anime"]
     total_font = template_details.fonts["total"]
     rank_font = template_details.fonts["rank"]
 
-    song_name_length = song_font.getlength(song_name)
-    while (song_name_length > WIDTH - MIN_EDGE_PADDING * 2):
-        font_size = song_font.size - 1
-        song_font = ImageFont.truetype(
-            "Fonts/Montserrat-Regular.ttf", font_size)
-        song_name_length = song_font.getlength(song_name)
+    song_font = fit_font(song_name, song_font, WIDTH - MIN_EDGE_PADDING * 2)
+    anime_font = fit_font(anime_name, anime_font, WIDTH - MIN_EDGE_PADDING * 2)
 
     draw = ImageDraw.Draw(panel)
     draw.rectangle(
         ((offset), (offset[0] + vf_w, offset[1] + vf_h)), outline=(193, 193, 193), width=1)
-    draw.text((vf_w / 2 + offset[0], offset[1] / 2), song_name, font=song_font,
+    draw.text(layout.anchors["song"], song_name, font=song_font,
               fill='white', stroke_width=1, stroke_fill='black', anchor="mm")
-    draw.text((vf_w / 2 + offset[0], (bg_h + offset[1] + vf_h) / 2), anime_name, font=anime_font,
+    draw.text(layout.anchors["anime"], anime_name, font=anime_font,
               fill='white', stroke_width=1, stroke_fill='black', anchor="mm")
 
-    rank_box_center = (offset[0] + (RANK_POSITION[0][0] * vf_w + RANK_POSITION[1][0] * vf_w) / 2,
-                       offset[1] + (RANK_POSITION[0][1] * vf_h + RANK_POSITION[1][1] * vf_h) / 2)
-    total_box_center = (offset[0] + (TOTAL_POSITION[0][0] * vf_w + TOTAL_POSITION[1][0] * vf_w) / 2,
-                        offset[1] + (TOTAL_POSITION[0][1] * vf_h + TOTAL_POSITION[1][1] * vf_h) / 2)
-    type_box_center = (offset[0] + (TYPE_POSITION[0][0] * vf_w + TYPE_POSITION[1][0] * vf_w) / 2,
-                       offset[1] + (TYPE_POSITION[0][1] * vf_h + TYPE_POSITION[1][1] * vf_h) / 2)
-
-    draw.text((rank_box_center), rank,
+    draw.text(layout.boxes["rank"], rank,
               font=rank_font, fill=(244, 186, 23),
               stroke_width=1, stroke_fill='black', anchor="mm")
-    draw.text((total_box_center), total,
+    draw.text(layout.boxes["total"], total,
               font=total_font, fill=(244, 186, 23),
               stroke_width=1, stroke_fill='black', anchor="mm")
     if song_info["song_type"]:
         song_type = song_info["song_type"]
         type_font = template_details.fonts["type"]
-        draw.text((type_box_center), song_type,
+        draw.text(layout.boxes["type"], song_type,
                   font=type_font, fill=(244, 186, 23),
                   stroke_width=1, stroke_fill='black', anchor="mm")
 
 
-def write_user_info(row: tuple, song_id: int, panel: Image.Image, nominator: str, template_details: PanelConfig) -> None:
-    low_people, high_people = getLowHighPeople(
-        row, template_details.people, nominator)
+def write_user_info(row: tuple, song_id: int, panel: Image.Image, nominator: str, template_details: PanelConfig,
+                    row_stats: RowStats) -> None:
     draw = ImageDraw.Draw(panel)
-
-    for person, (start_x, start_y) in zip(template_details.people, template_details.avatar_positions):
-        value = float(row[person.index])
-        score = int(value) if value.is_integer() else f"{float(value):.1f}"
-        text_color = "white"
-
-        if template_details.mode == 'dartboard':
-            if score < 4:
-                border_color = (253, 255, 114) if score == 1 else \
-                               (229, 229, 229) if score == 2 else \
-                               (186, 137, 95)
-                glow = create_glow(10)
-                draw_glow(panel, (start_x - 10, start_y - 10),
+    guesses = template_details.guesses
+    guess_row = guesses.row(song_id) if template_details.mode == 'dartboard' else None
+    layout = template_details.layout
+    score_anchors = layout.slot_anchors["score"]
+    guess_anchors = layout.slot_anchors.get("guess")
+
+    for index, (tile, baked, (start_x, start_y)) in enumerate(zip(
+            template_details.avatar_tiles, template_details.baked_tiles, layout.avatar_slots)):
+        score = row_stats.scores[index]
+        text_color = row_stats.colors[index]
+        border_color = row_stats.glows[index]
+        glowing = border_color is not None
+        if glowing:
+            with profiler.stage("glow"):
+                glow = create_glow(GLOW_WIDTH, AVATAR_SIZE)
+                # The glow goes under the avatar, so take a baked avatar back out and paste it again after
+                if baked:
+                    tile.clear(panel, (start_x, start_y), template_details.base_template)
+                draw_glow(panel, layout.slot_anchors["glow"][index],
                           glow, border_color)
-            panel.paste(person.avatar, (start_x, start_y))
-            score_box_tl = (start_x, int(start_y + AVATAR_SIZE - (AVATAR_SIZE * 0.3)))
-            score_box_br = (int(start_x + AVATAR_SIZE * 0.3), start_y + AVATAR_SIZE)
-
-            draw.rectangle(
-                (score_box_tl, score_box_br),
-                fill=(0,0,0),
-                outline=(255, 255, 255), width=1
-            )
-            draw.rectangle(
-                ((start_x, start_y), (start_x + AVATAR_SIZE, start_y + AVATAR_SIZE)),
-                outline=(193, 193, 193), width=1
+        if glowing or not baked:
+            tile.paste(panel, (start_x, start_y))
+
+        if guess_anchors and not row_stats.nominators[index] and not guesses.empty[guess_row, index]:
+            guess = guesses.guesses[guess_row, index]
+            guess_color = (47, 193, 87) if guesses.correct[guess_row, index] else (241, 61, 66)
+            guess_pos, guess_width = guess_anchors[index]
+            guess_cleaned = truncate_to_width(str(guess), template_details.fonts["guess"], guess_width)
+            draw.text(
+                (guess_pos), guess_cleaned, font=template_details.fonts["guess"], fill="white",
+                stroke_width=2, stroke_fill=guess_color,
+                anchor='lm'
             )
+        template_details.score_atlas.draw(
+            panel, score_anchors[index], str(score), text_color, anchor="mm", stroke_fill='black')
 
-            low_color = (53, 182, 31, 255)
-            high_color = (255, 0, 0, 255)
-            nom_color = (0, 255, 255, 255)
-            score_pos = ((score_box_tl[0] + score_box_br[0]) // 2, (score_box_tl[1] + score_box_br[1]) // 2)
-            if(person.full_name.lower() != nominator.lower()):
-                # print(global_guesses_dict)
-                guess = global_guesses_dict[song_id][person.full_name]
-                guess_color = (241, 61, 66) if guess != nominator else (47, 193, 87)
-                # guess_cleaned = clean_name(guess, AVATAR_SIZE * .75)
-                guess_pos = (int(start_x + AVATAR_SIZE * 0.3) + 10, int(start_y + AVATAR_SIZE - template_details.fonts["guess"].size * 0.1))
-                draw.text(
-                    (guess_pos), guess, font=template_details.fonts["guess"], fill="white",
-                    stroke_width=2, stroke_fill=guess_color,
-                    anchor='lm'
-                )
 
-        else:
-            score_pos = (start_x + AVATAR_SIZE / 2, 
-                start_y + AVATAR_SIZE - template_details.fonts["score"].size * 0.2)
-            if template_details.mode == 'ranking':
-                if score < 4:
-                    border_color = (253, 255, 114) if score == 1 else \
-                                (229, 229, 229) if score == 2 else \
-                                (186, 137, 95)
-                    glow = create_glow(10)
-                    draw_glow(panel, (start_x - 10, start_y - 10),
-                            glow, border_color)
-
-                low_color = (53, 182, 31, 255)
-                high_color = (255, 0, 0, 255)
-                nom_color = (0, 255, 255, 255)
-
-            elif template_details.mode == "scoring":
-                low_color = (255, 0, 0, 255)
-                high_color = (53, 182, 31, 255)
-                nom_color = (0, 255, 255, 255)
-            else:
-                raise ValueError(f"Unsupported mode: {template_details.mode}")
-
-            if person in low_people:
-                text_color = low_color
-            elif person in high_people:
-                text_color = high_color
-            elif nominator and person.full_name.lower() == nominator.lower():
-                text_color = nom_color
-
-            panel.paste(person.avatar, (start_x, start_y))
-            draw.rectangle(
-                ((start_x, start_y), (start_x + AVATAR_SIZE, start_y + AVATAR_SIZE)),
-                outline=(193, 193, 193), width=1
-            )
-        draw.text(
-            (start_x + AVATAR_SIZE / 2, start_y), person.print_name, font=template_details.fonts["name"], fill="white",
-            stroke_width=2, stroke_fill='black',
-            anchor="mm"
-        )
-        draw.text(
-            score_pos,
-            str(score), font=template_details.fonts["score"],
-            fill=text_color, stroke_width=2, stroke_fill='black',
-            anchor="mm"
-        )
-
-
-def create_glow(glow_width: int) -> Image.Image:
-    width = AVATAR_SIZE + glow_width * 2
+@functools.lru_cache(maxsize=None)
+def create_glow(glow_width: int, avatar_size: int) -> Image.Image:
+    """Alpha mask for the glow around one avatar. Cached per (width, avatar size)
+    since every glowing avatar on every panel uses the same mask."""
+    width = avatar_size + glow_width * 2
 
     def calc_alpha(x, y):
         d = np.abs(
-            np.stack([(x - width / 2), (y - width / 2)])) - AVATAR_SIZE / 2
+            np.stack([(x - width / 2), (y - width / 2)])) - avatar_size / 2
         l = np.linalg.norm(np.maximum(d, 0), axis=0)
         # m = np.minimum(np.max(d, axis = 0), 0)
         distance = l
@@ -452,67 +717,107 @@ def create_glow(glow_width: int) -> Image.Image:
     return im
 
 
+@functools.lru_cache(maxsize=None)
+def glow_tile(glow_color, size: tuple[int, int]) -> Image.Image:
+    """Solid colored tile the glow mask is composited from, one per color and size."""
+    return Image.new(mode="RGBA", size=size, color=glow_color)
+
+
 def draw_glow(
     panel: Image.Image,
     pos: tuple[int, int],
     glow: Image.Image,
     glow_color="yellow",
 ) -> None:
-    glow_base = Image.new(mode="L", size=panel.size)
+    # Only the box under the glow mask changes, so composite that region instead of the whole panel
     x, y = pos
-    tmp = Image.new(mode="L", size=panel.size)
-    tmp.paste(glow, (x, y))
-    # We don't use Image.paste here because we want to just take the whiter value
-    glow_base = ImageChops.lighter(glow_base, tmp)
-    # in theory we could paste the glows with a mask on a separate layer with the boxes
+    box = (x, y, x + glow.width, y + glow.height)
+    region = panel.crop(box)
     new_im = Image.composite(
-        Image.new(mode="RGBA", size=panel.size, color=glow_color),
-        panel,
-        glow_base,
+        glow_tile(glow_color, glow.size),
+        region,
+        glow,
     )
-    panel.paste(new_im)
+    panel.paste(new_im, (x, y))
 
 
 def clean_name(name: str, max_length) -> str:
     name = re.sub(r'\d+', '', name).strip()
-    font = ImageFont.truetype("Fonts/antipasto.regular.ttf", size=30)
-    name_length = font.getlength(name)
-    while (name_length > max_length ):
-        decrease = max_length / name_length
-        num_char = len(name)
-        name = name[:int(num_char * decrease)]
-        name_length = font.getlength(name)
-    return name
-
-
-def getLowHighPeople(
-        row: tuple,
-        people: list[Person],
-        nominator:
-        str) -> tuple[list[Person], list[Person]]:
-    low_score = None
-    high_score = None
-    low_people = []
-    high_people = []
-    for person in people:
-        if (person.full_name.lower() != nominator.lower()):
-            index = person.index
-            score = row[index]
-            if low_score is None or score < low_score:
-                low_score = score
-            if high_score is None or score > high_score:
-                high_score = score
+    return truncate_to_width(name, get_font("Fonts/antipasto.regular.ttf", 30 * RENDER_SCALE), max_length)
+
+
+def format_score(value: float) -> str:
+    if np.isnan(value):
+        return ""
+    return str(int(value)) if float(value).is_integer() else f"{float(value):.1f}"
+
+
+def compute_row_stats(rows: list[tuple], template_details: PanelConfig,
+                      sheet_stats: Optional[SheetStats] = None) -> list[RowStats]:
+    """Works out lowest/highest scorers, glows and score text for a batch of rows at once
+    from a (rows x rankers) matrix of scores"""
+    mode = template_details.mode
+    if mode == 'ranking':
+        low_color, high_color = (53, 182, 31, 255), (255, 0, 0, 255)
+    elif mode == 'scoring':
+        low_color, high_color = (255, 0, 0, 255), (53, 182, 31, 255)
+    elif mode == 'dartboard':
+        low_color = high_color = "white"
+    else:
+        raise ValueError(f"Unsupported mode: {mode}")
+    nom_color = (0, 255, 255, 255)
+
+    people = template_details.people
+    nominator_column = template_details.info_dict["nominator_column"]
+    values = np.array([[row[person.index] for person in people] for row in rows], dtype=float).reshape(len(rows), len(people))
+    names = np.array([person.full_name.lower() for person in people], dtype=object)
+    if nominator_column is None:
+        is_nominator = np.zeros(values.shape, dtype=bool)
+    else:
+        nominators = np.array([str(row[nominator_column]).lower() if row[nominator_column] else None for row in rows], dtype=object)
+        is_nominator = names[None, :] == nominators[:, None]
+
+    # The nominator never counts towards a row's lowest or highest score
+    valid = ~np.isnan(values) & ~is_nominator
+    low = np.min(np.where(valid, values, np.inf), axis=1, keepdims=True)
+    high = np.max(np.where(valid, values, -np.inf), axis=1, keepdims=True)
+    is_low = valid & (values == low)
+    is_high = valid & (values == high) & ~is_low
+    if sheet_stats is not None:
+        sheet_stats.update(values, valid, is_low, is_high)
+
+    # Codes into the palettes below, worked out for the whole batch at once
+    if mode == 'dartboard':
+        color_codes = np.zeros(values.shape, dtype=int)
+    else:
+        color_codes = np.select([is_low, is_high, is_nominator], [1, 2, 3], 0)
+    color_palette = ["white", low_color, high_color, nom_color]
+
+    # Top three places in ranking and dartboard get a gold, silver or bronze glow
+    if mode == 'scoring':
+        glow_codes = np.zeros(values.shape, dtype=int)
+    else:
+        glow_codes = np.select([values == 1, values == 2, values < 4], [1, 2, 3], 0)
+    glow_palette = [None, (253, 255, 114), (229, 229, 229), (186, 137, 95)]
+
+    return [
+        RowStats(
+            [format_score(value) for value in values[i]],
+            [color_palette[code] for code in color_codes[i]],
+            [glow_palette[code] for code in glow_codes[i]],
+            is_nominator[i].tolist())
+        for i in range(len(rows))
+    ]
 
-    for person in people:
-        if (person.full_name.lower() != nominator.lower()):
-            index = person.index
-            score = row[index]
-            if score == low_score:
-                low_people.append(person)
-            elif score == high_score:
-                high_people.append(person)
 
-    return (low_people, high_people)
+def with_row_stats(rows: Iterable[tuple], template_details: PanelConfig,
+                   sheet_stats: Optional[SheetStats] = None) -> Generator[tuple[tuple, RowStats]]:
+    """Pairs each row with its RowStats, computing them ROW_STATS_BATCH rows at a time so rows still stream"""
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, ROW_STATS_BATCH)):
+        with profiler.stage("row stats"):
+            batch_stats = compute_row_stats(batch, template_details, sheet_stats)
+        yield from zip(batch, batch_stats)
 
 
 def adjust_frame(template_details: PanelConfig, type_column: Optional[int], single_sided: str) -> Image.Image:
@@ -527,10 +832,11 @@ def adjust_frame(template_details: PanelConfig, type_column: Optional[int], sing
     new_width = bg_w - avatar_space
     new_frame = template_details.video_frame.resize((new_width, vf_h))
     if (type_column is None):
+        type_position = template_details.box_positions["type"]
         rect_width = int(
-            (TYPE_POSITION[1][0] - TYPE_POSITION[0][0]) * new_width * 1.3)
+            (type_position[1][0] - type_position[0][0]) * new_width * 1.3)
         rect_height = int(
-            (TYPE_POSITION[1][1] - TYPE_POSITION[0][1]) * vf_h * 1.3)
+            (type_position[1][1] - type_position[0][1]) * vf_h * 1.3)
         rect_pos = (new_width - rect_width), 0
 
         transparent = Image.new(
@@ -540,43 +846,592 @@ def adjust_frame(template_details: PanelConfig, type_column: Optional[int], sing
     return new_frame
 
 
-def main(args) -> None:
-    global global_guesses_dict
-    sheet_name = args.sheet
-    inside_box_count = args.inside_box
-    mode = args.mode
-    is_centered = args.centered
-    is_single_sided = args.single_sided
-    dartboard = args.dartboard
-
-    save_path = create_dirs(sheet_name)
-    file_path = os.path.join(os.getcwd(), sheet_name)
-    wrkbk = openpyxl.load_workbook(sheet_name, data_only=True)
-    sheet = wrkbk.worksheets[0]
-    
-    indices_info, people = get_columns(sheet)
-    global_guesses_dict = create_guesses_dict(wrkbk, dartboard) if dartboard else None
-    guesses_dict = {}
-    template_details = PanelConfig(
-        mode, indices_info, people, save_path, is_centered, is_single_sided, guesses_dict)
-
-    template_details.video_frame = adjust_frame(
-        template_details, indices_info["type_column"], is_single_sided)
+def solve_layout(people_count: int, bg_size: tuple[int, int], vf_size: tuple[int, int]) -> Optional[dict]:
+    """Scores every (columns, avatar size, padding, inside box count, sides) combination at once and returns
+    the one with the largest avatars that fits without making the video frame narrower than the default layout does.
+    Ties go to fewer avatars in the video box, avatars on both sides, more padding and then fewer columns.
+    Layouts are cached per people count and template size"""
+    return _solve_layout(people_count, tuple(bg_size), tuple(vf_size))
+
+
+@functools.lru_cache(maxsize=None)
+def _solve_layout(people_count: int, bg_size: tuple[int, int], vf_size: tuple[int, int]) -> Optional[dict]:
+    bg_w, bg_h = bg_size
+    _, vf_h = vf_size
+    sides = np.array(LAYOUT_SIDES)
+    cols, size, pad, inside, side = (grid.ravel() for grid in np.meshgrid(
+        np.array(LAYOUT_COLUMNS), np.array(LAYOUT_AVATAR_SIZES), np.array(LAYOUT_X_PADS),
+        np.arange(min(LAYOUT_MAX_INSIDE, people_count) + 1), np.arange(len(sides)), indexing="ij"))
+    double_sided = sides[side] == "off"
+
+    # Same space adjust_frame takes away from the video frame
+    space_per_side = (cols + 1) * pad + cols * size
+    frame_w = bg_w - np.where(double_sided, space_per_side * 2, space_per_side + pad)
+    default_size, default_cols, default_pad = DEFAULT_LAYOUT_SETTINGS
+    min_frame_w = bg_w - 2 * ((default_cols + 1) * default_pad + default_cols * default_size)
+
+    outside = people_count - inside
+    per_side = np.where(double_sided, -(-outside // 2), outside)
+    rows = -(-per_side // cols)
+    column_height = rows * size + np.maximum(rows - 1, 0) * Y_PAD + MIN_EDGE_PADDING
+
+    fits = (
+        (frame_w >= min_frame_w)
+        & (column_height <= bg_h)
+        & (inside * size + (inside + 1) * pad <= frame_w)
+        & ((inside == 0) | (size + Y_PAD + 10 <= vf_h * LAYOUT_MAX_INSIDE_HEIGHT))
+    )
+    if not fits.any():
+        return None
+
+    # lexsort sorts by the last key first, so this is avatar size, then the tie breaks in order
+    order = np.lexsort((cols, -pad, ~double_sided, inside, -size))
+    best = order[fits[order]][0]
+    return {
+        "avatar_size": int(size[best]),
+        "columns": int(cols[best]),
+        "x_pad": int(pad[best]),
+        "inside_box": int(inside[best]),
+        "single_sided": str(sides[side[best]]),
+    }
 
-    template_details.get_avatar_positions(inside_box_count, is_single_sided)
-    template_panel = create_template(template_details)
 
-    for index, row in enumerate(sheet.iter_rows(min_row=2, values_only=True)):
+def apply_layout(layout: Optional[dict], args) -> None:
+    global AVATAR_SIZE, NUM_COLS_PER_SIDE, X_PAD
+    if layout is None:
+        print("[WARNING] No layout fits this many people, keeping the settings at the top of the file")
+        return
+    AVATAR_SIZE = layout["avatar_size"]
+    NUM_COLS_PER_SIDE = layout["columns"]
+    X_PAD = layout["x_pad"]
+    args.inside_box = layout["inside_box"]
+    args.single_sided = layout["single_sided"]
+    print(f"[INFO] Using layout {layout}")
+
+
+def setup_panels(args, save_path: str, writer_threads: int = 2) -> tuple[PanelConfig, Image.Image]:
+    # Every sheet starts from the settings at the top of the file, not the layout picked for the sheet before it
+    set_layout_settings(DEFAULT_LAYOUT_SETTINGS)
+    with profiler.stage("workbook load"):
+        header = read_header(args.sheet)
+    with profiler.stage("column detection"):
+        indices_info, people = get_columns(header)
+    if getattr(args, "auto_layout", False):
+        with profiler.stage("layout"):
+            layout = solve_layout(len(people), asset_pool.image(BG_PATH).size, asset_pool.image(FRAME_PATH).size)
+        apply_layout(layout, args)
+    if getattr(args, "preview", None):
+        apply_render_scale(args.preview)
+    with profiler.stage("avatar load"):
+        load_avatars(people)
+    guesses = None
+    if args.mode == 'dartboard':
+        with profiler.stage("workbook load"):
+            guesses = create_guesses_index(args.sheet, args.dartboard, people)
+        with profiler.stage("guess validation"):
+            id_column, nominator_column = indices_info["id_column"], indices_info["nominator_column"]
+            guesses.validate(
+                ((song_key(row[id_column]), row[nominator_column] if nominator_column is not None else None)
+                 for row in iter_song_rows(args.sheet)),
+                people)
+    with profiler.stage("template build"):
+        template_details = PanelConfig(
+            args.mode, indices_info, people, save_path, args.centered, args.single_sided, guesses,
+            static_layer=not getattr(args, "no_static_layer", False))
+
+        template_details.video_frame = adjust_frame(
+            template_details, indices_info["type_column"], args.single_sided)
+
+        template_details.writer = PanelWriter(
+            image_format=getattr(args, "format", "png"),
+            compress_level=getattr(args, "compress_level", None),
+            drop_alpha=getattr(args, "drop_alpha", False),
+            threads=writer_threads)
+
+        template_details.get_avatar_positions(args.inside_box, args.single_sided)
+        template_details.layout = build_layout(template_details)
+        template_panel = create_template(template_details)
+    return (template_details, template_panel)
+
+
+def apply_render_scale(scale: float) -> None:
+    """Scales the pixel settings so the same layout code lays out a smaller panel. Fonts, the background
+    and the frame follow RENDER_SCALE. Only call this once per process"""
+    global RENDER_SCALE, AVATAR_SIZE, X_PAD, Y_PAD, MIN_EDGE_PADDING, WIDTH, HEIGHT, GLOW_WIDTH
+    RENDER_SCALE = scale
+    AVATAR_SIZE, X_PAD, Y_PAD, MIN_EDGE_PADDING, WIDTH, HEIGHT, GLOW_WIDTH = (
+        max(1, round(value * scale)) for value in (AVATAR_SIZE, X_PAD, Y_PAD, MIN_EDGE_PADDING, WIDTH, HEIGHT, GLOW_WIDTH))
+
+
+def use_sheet(template_details: PanelConfig) -> None:
+    """Puts back the module settings a sheet was set up with, for when several sheets are rendered in one process"""
+    set_layout_settings(template_details.layout_settings)
+
+
+def set_layout_settings(settings: tuple[int, int, int]) -> None:
+    global AVATAR_SIZE, NUM_COLS_PER_SIDE, X_PAD
+    AVATAR_SIZE, NUM_COLS_PER_SIDE, X_PAD = settings
+
+
+def build_layout(template_details: PanelConfig) -> PanelLayout:
+    """Everything write_song_info and write_user_info place text or images at, for the sized frame and placed avatars"""
+    bg_w, bg_h = template_details.background.size
+    vf_w, vf_h = template_details.video_frame.size
+    offset = template_details.offset
+    fonts = template_details.fonts
+    slots = tuple(template_details.avatar_positions)
+    slot_anchors = {"glow": tuple((x - GLOW_WIDTH, y - GLOW_WIDTH) for x, y in slots)}
+    if template_details.mode == 'dartboard':
+        score_anchors = []
+        guess_anchors = []
+        for start_x, start_y in slots:
+            score_box_tl = (start_x, int(start_y + AVATAR_SIZE - (AVATAR_SIZE * 0.3)))
+            score_box_br = (int(start_x + AVATAR_SIZE * 0.3), start_y + AVATAR_SIZE)
+            score_anchors.append(((score_box_tl[0] + score_box_br[0]) // 2, (score_box_tl[1] + score_box_br[1]) // 2))
+            guess_pos = (int(start_x + AVATAR_SIZE * 0.3) + 10, int(start_y + AVATAR_SIZE - fonts["guess"].size * 0.1))
+            # Guesses may run into the padding past the avatar but not into the next avatar
+            guess_anchors.append((guess_pos, start_x + AVATAR_SIZE + X_PAD - 5 - guess_pos[0]))
+        slot_anchors["score"] = tuple(score_anchors)
+        slot_anchors["guess"] = tuple(guess_anchors)
+    else:
+        slot_anchors["score"] = tuple((start_x + AVATAR_SIZE / 2, start_y + AVATAR_SIZE - fonts["score"].size * 0.2)
+                                      for start_x, start_y in slots)
+    return frame_layout(
+        (bg_w, bg_h), (vf_w, vf_h), offset, template_details.box_positions,
+        anchors={
+            "song": (vf_w / 2 + offset[0], offset[1] / 2),
+            "anime": (vf_w / 2 + offset[0], (bg_h + offset[1] + vf_h) / 2),
+        },
+        avatar_slots=slots,
+        slot_anchors=slot_anchors)
+
+
+def iter_song_rows(sheet_name: str) -> Generator[tuple]:
+    sheet_rows = iter_sheet_rows(sheet_name)
+    rows = profiler.timed(sheet_rows, "workbook load")
+    next(rows, None)
+    for index, row in enumerate(rows):
         if row is None or row[0] is None:
             print(f"[INFO] Hit none on row {index + 2}. Exiting")
             break
-        create_song_panel(row, template_details, template_panel)
+        yield row
+    sheet_rows.close()
+
+
+# Per-process state for --workers. Each worker builds its own template, fonts and avatars once
+worker_state = None
+
+
+def init_worker(args, save_path: str) -> None:
+    global worker_state
+    profiler.start_worker(trace_path(getattr(args, "profile", None), save_path) is not None)
+    # Workers already run side by side, so each one writes its panels itself
+    template_details, template_panel = setup_panels(args, save_path, writer_threads=0)
+    worker_state = (template_details, template_panel)
+
+
+def render_row(item: tuple[tuple, RowStats]) -> list:
+    """Renders a row in a worker and hands its profiler events back to the main process"""
+    row, row_stats = item
+    template_details, template_panel = worker_state
+    create_song_panel(row, template_details, template_panel, row_stats)
+    return profiler.drain()
+
+
+def render_frame(item: tuple[tuple, RowStats]) -> tuple[bytes, list]:
+    row, row_stats = item
+    template_details, template_panel = worker_state
+    return render_song_panel(row, template_details, template_panel, row_stats).tobytes(), profiler.drain()
+
+
+def init_batch_worker(sheet_args: dict, profile: bool) -> None:
+    global worker_state
+    profiler.start_worker(profile)
+    # Sheets are set up the first time this worker gets one of their rows, sharing this process's asset_pool
+    worker_state = {"args": sheet_args, "sheets": {}}
+
+
+def render_batch_row(item: tuple[str, tuple, RowStats]) -> tuple[str, float, list]:
+    sheet, row, row_stats = item
+    start = time.perf_counter()
+    sheets = worker_state["sheets"]
+    if sheet not in sheets:
+        args = worker_state["args"][sheet]
+        sheets[sheet] = setup_panels(args, create_dirs(args.sheet), writer_threads=0)
+    template_details, template_panel = sheets[sheet]
+    use_sheet(template_details)
+    create_song_panel(row, template_details, template_panel, row_stats)
+    return sheet, time.perf_counter() - start, profiler.drain()
+
+
+def parse_duration(value, default: float) -> float:
+    """Seconds a panel stays on screen. Accepts seconds, "m:ss"/"h:mm:ss" text or a time cell"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, datetime.time):
+        return value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    seconds = 0.0
+    for part in str(value).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def create_video(args, template_details: PanelConfig, template_panel: Image.Image) -> None:
+    """Renders every panel in rank order straight into an ffmpeg process, without writing image files"""
+    info_dict = template_details.info_dict
+    rows = sorted(iter_song_rows(args.sheet), key=lambda row: float(row[info_dict["rank_column"]]),
+                  reverse=getattr(args, "countdown", False))
+    if info_dict["duration_column"] is None:
+        print(f"[INFO] No duration column, showing every panel for {args.duration} seconds")
+    durations = [
+        parse_duration(row[info_dict["duration_column"]] if info_dict["duration_column"] is not None else None,
+                       args.duration)
+        for row in rows
+    ]
+    items = list(with_row_stats(rows, template_details))
+
+    video = VideoWriter(args.video, template_panel.size, durations, fps=args.fps, lossless=args.lossless)
+    try:
+        if args.workers > 1:
+            with ProcessPoolExecutor(max_workers=args.workers,
+                                     initializer=init_worker,
+                                     initargs=(args, template_details.base_path)) as pool:
+                # Only VIDEO_QUEUE_SIZE frames per worker are rendered ahead of ffmpeg, since each is a full
+                # RGBA panel held in memory. They are taken in submission order so the frames stay in rank order
+                pending = deque()
+                for item, duration in zip(items, durations):
+                    if len(pending) >= args.workers * VIDEO_QUEUE_SIZE:
+                        add_frame(video, *pending.popleft())
+                    pending.append((pool.submit(render_frame, item), duration))
+                while pending:
+                    add_frame(video, *pending.popleft())
+        else:
+            for (row, row_stats), duration in zip(items, durations):
+                video.add(render_song_panel(row, template_details, template_panel, row_stats).tobytes(), duration)
+    finally:
+        video.close()
+
+
+def add_frame(video: VideoWriter, future: Future, duration: float) -> None:
+    frame, events = future.result()
+    profiler.add(events)
+    video.add(frame, duration)
+
+
+def asset_hash(template_details: PanelConfig, args) -> str:
+    """Hash of everything besides the row that ends up in a panel, RENDER_VERSION included. Any change here
+    re-renders every panel. Files are keyed on their modification time and size, like the thumbnail cache,
+    so they aren't read"""
+    digest = hashlib.sha1()
+    paths = [BG_PATH, FRAME_PATH]
+    paths += sorted({font.path for font in template_details.fonts.values()})
+    paths += [os.path.join(AVATAR_PATH, f"{person.full_name}.png") for person in template_details.people]
+    for path, stamp in file_stamps(paths).items():
+        digest.update(f"{path}:{stamp}\n".encode())
+    layout = (RENDER_VERSION, X_PAD, Y_PAD, MIN_EDGE_PADDING, AVATAR_SIZE, NUM_COLS_PER_SIDE, WIDTH, HEIGHT,
+              template_details.layout.to_dict(),
+              args.mode, args.inside_box, args.centered, args.single_sided,
+              template_details.info_dict, [person.index for person in template_details.people],
+              template_details.writer.options())
+    digest.update(repr(layout).encode())
+    return digest.hexdigest()
+
+
+def row_hash(row: tuple, assets: str, template_details: PanelConfig) -> str:
+    guesses = None
+    if template_details.guesses is not None:
+        guess_row = template_details.guesses.row(song_key(row[template_details.info_dict["id_column"]]))
+        guesses = template_details.guesses.guesses[guess_row].tolist()
+    return hashlib.sha1(repr((assets, row, guesses)).encode()).hexdigest()
+
+
+def plan_rows(items: Iterable[tuple[tuple, RowStats]], template_details: PanelConfig, args,
+              old_manifest: dict, manifest: dict) -> Generator[tuple[tuple, RowStats]]:
+    """Yields the rows whose panel is missing or out of date as they are read, recording every row in manifest"""
+    save_path = template_details.base_path
+    assets = asset_hash(template_details, args)
+    for row, row_stats in items:
+        filename = panel_filename(row, template_details.info_dict, template_details.writer.extension)
+        manifest[filename] = row_hash(row, assets, template_details)
+        if old_manifest.get(filename) != manifest[filename] or not os.path.exists(os.path.join(save_path, filename)):
+            yield (row, row_stats)
+
+
+def render_sheet(args, template_details: PanelConfig, template_panel: Image.Image,
+                 force: bool = False, workers: int = 1) -> int:
+    """Renders the rows whose panel is out of date, removes panels of deleted rows and saves the manifest.
+    Returns how many panels were rendered"""
+    save_path = template_details.base_path
+    old_manifest = {} if force else load_manifest(save_path)
+    manifest = {}
+    sheet_stats = SheetStats(template_details.people)
+    # Rows are read as they are rendered, so the first panels are done before the sheet is fully parsed
+    rows = plan_rows(with_row_stats(iter_song_rows(args.sheet), template_details, sheet_stats),
+                     template_details, args, old_manifest, manifest)
+
+    rendered = 0
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(args, save_path)) as pool:
+            for events in pool.map(render_row, rows):
+                profiler.add(events)
+                rendered += 1
+    else:
+        for row, row_stats in rows:
+            create_song_panel(row, template_details, template_panel, row_stats)
+            rendered += 1
+        template_details.writer.flush()
+    remove_stale_panels(save_path, old_manifest, manifest)
+    save_manifest(save_path, manifest)
+    print(f"[INFO] Rendered {rendered} of {len(manifest)} panels")
+    sheet_stats.report()
+    return rendered
+
+
+def main(args) -> None:
+    save_path = create_dirs(args.sheet)
+    profile_path = trace_path(getattr(args, "profile", None), save_path)
+    profiler.enabled = profile_path is not None
+
+    template_details, template_panel = setup_panels(args, save_path, getattr(args, "writer_threads", 2))
+    if getattr(args, "video", None):
+        create_video(args, template_details, template_panel)
+        if profile_path:
+            profiler.report()
+            profiler.write_trace(profile_path)
+        return
+
+    rendered = render_sheet(args, template_details, template_panel,
+                            force=getattr(args, "force", False), workers=getattr(args, "workers", 1))
+    template_details.writer.close()
+    if profile_path:
+        profiler.report()
+        profiler.write_trace(profile_path)
+
+    if template_details.static_layer and rendered:
+        saved = template_details.static_layer_time
+        print(f"[INFO] Static avatar layer saved ~{saved * 1000:.1f} ms per panel, "
+              f"~{saved * rendered:.2f} s over {rendered} panels")
+
+
+def sample_rows(rows: list[tuple], count: int, spread: bool) -> list[tuple]:
+    """The first count rows, or count rows spread evenly from the first to the last"""
+    if not spread or count >= len(rows):
+        return rows[:count]
+    picks = np.unique(np.linspace(0, len(rows) - 1, count).round().astype(int))
+    return [rows[i] for i in picks]
+
+
+def create_contact_sheet(panels: list[Image.Image], gap: int = 10) -> Image.Image:
+    """All panels tiled into one image, in rows of about the square root of the panel count"""
+    columns = math.ceil(math.sqrt(len(panels)))
+    rows = math.ceil(len(panels) / columns)
+    tile_w = max(panel.width for panel in panels)
+    tile_h = max(panel.height for panel in panels)
+    sheet = Image.new("RGB", (columns * (tile_w + gap) + gap, rows * (tile_h + gap) + gap), "black")
+    for i, panel in enumerate(panels):
+        x, y = gap + (i % columns) * (tile_w + gap), gap + (i // columns) * (tile_h + gap)
+        sheet.paste(panel.convert("RGB"), (x, y))
+    return sheet
+
+
+def main_preview(args) -> None:
+    """Renders a few rows at args.preview times the full size, for checking a layout quickly.
+    Panels go to a preview folder and the manifest is left alone, so the next full run isn't affected"""
+    start = time.perf_counter()
+    save_path = os.path.join(create_dirs(args.sheet), PREVIEW_DIR)
+    os.makedirs(save_path, exist_ok=True)
+    profile_path = trace_path(getattr(args, "profile", None), save_path)
+    profiler.enabled = profile_path is not None
+
+    template_details, template_panel = setup_panels(args, save_path, writer_threads=0)
+    # Fast to write, these are thrown away
+    template_details.writer = PanelWriter(compress_level=1, threads=0)
+    if args.preview_sample:
+        rows = sample_rows(list(iter_song_rows(args.sheet)), args.preview_rows, spread=True)
+    else:
+        rows = list(itertools.islice(iter_song_rows(args.sheet), args.preview_rows))
+
+    panels = []
+    for row, row_stats in with_row_stats(rows, template_details):
+        with profiler.stage("render"):
+            panel = render_song_panel(row, template_details, template_panel, row_stats)
+        template_details.writer.save(
+            panel, os.path.join(save_path, panel_filename(row, template_details.info_dict)))
+        panels.append(panel)
+    if args.contact_sheet and panels:
+        contact_path = os.path.join(save_path, "contact_sheet.png")
+        template_details.writer.save(create_contact_sheet(panels), contact_path)
+        print(f"[INFO] Wrote contact sheet to {contact_path}")
+    print(f"[INFO] Previewed {len(panels)} panels at {args.preview:g}x in {time.perf_counter() - start:.2f} s")
+    if profile_path:
+        profiler.report()
+        profiler.write_trace(profile_path)
+
+
+def watched_files(args, template_details: PanelConfig) -> list[str]:
+    """Every file that ends up in a panel: the sheet, background, frame and its box positions, fonts and avatars"""
+    paths = [args.sheet, BG_PATH, FRAME_PATH, box_positions_path(FRAME_PATH)]
+    paths += sorted({font.path for font in template_details.fonts.values()})
+    paths += [os.path.join(AVATAR_PATH, f"{person.full_name}.png") for person in template_details.people]
+    return paths
+
+
+def main_watch(args) -> None:
+    """Renders the sheet, then keeps the fonts, images and layout loaded and re-renders whenever a file
+    the panels depend on changes. A sheet edit only re-renders the rows that changed.
+    Any other file, a new column or the guesses of a dartboard sheet set the panels up again first"""
+    save_path = create_dirs(args.sheet)
+    template_details, template_panel = setup_panels(args, save_path, getattr(args, "writer_threads", 2))
+    header = read_header(args.sheet)
+    render_sheet(args, template_details, template_panel, force=getattr(args, "force", False),
+                 workers=getattr(args, "workers", 1))
+    stamps = file_stamps(watched_files(args, template_details))
+    print(f"[INFO] Watching {len(stamps)} files for changes. Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = file_stamps(list(stamps))
+            changed = {path for path in current if current[path] != stamps[path]}
+            if not changed:
+                continue
+            start = time.perf_counter()
+            print(f"[INFO] Changed: {', '.join(sorted(changed))}")
+            try:
+                new_header = read_header(args.sheet) if args.sheet in changed else header
+                if changed != {args.sheet} or new_header != header or args.mode == "dartboard":
+                    asset_pool.forget(changed)
+                    if changed & {font.path for font in template_details.fonts.values()}:
+                        clear_font_cache()
+                        glyph_atlas.cache_clear()
+                    template_details.writer.close()
+                    template_details, template_panel = setup_panels(
+                        args, save_path, getattr(args, "writer_threads", 2))
+                header = new_header
+                render_sheet(args, template_details, template_panel, workers=getattr(args, "workers", 1))
+            except Exception as e:
+                # Most likely the sheet was read halfway through a save. Try again on the next change
+                print(f"[WARNING] Could not update the panels: {e!r}")
+            stamps = file_stamps(watched_files(args, template_details))
+            print(f"[INFO] Updated in {time.perf_counter() - start:.2f} s")
+    except KeyboardInterrupt:
+        print("[INFO] Stopped watching")
+    finally:
+        template_details.writer.close()
+
+
+def find_sheets(pattern: str) -> list[str]:
+    """Every sheet in a directory, or every file matching a glob pattern"""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    # Excel leaves "~$name.xlsx" lock files next to open workbooks
+    return sorted(path for path in paths
+                  if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm", ".csv")
+                  and not os.path.basename(path).startswith("~$"))
+
+
+def is_batch(sheet: str) -> bool:
+    return os.path.isdir(sheet) or glob.has_magic(sheet)
+
+
+def main_batch(args) -> None:
+    """Renders every sheet matched by args.sheet on one worker pool. Fonts, the background, the frame
+    and avatars are decoded once per process and shared by all sheets instead of once per sheet"""
+    batch_start = time.perf_counter()
+    sheets = find_sheets(args.sheet)
+    if not sheets:
+        print(f"[WARNING] No sheets found in {args.sheet}")
+        return
+    workers = getattr(args, "workers", 1)
+    profile_path = trace_path(getattr(args, "profile", None), SAVE_PATH)
+    profiler.enabled = profile_path is not None
+    writer = PanelWriter(
+        image_format=getattr(args, "format", "png"),
+        compress_level=getattr(args, "compress_level", None),
+        drop_alpha=getattr(args, "drop_alpha", False),
+        threads=getattr(args, "writer_threads", 2))
+
+    # Every sheet gets its own copy of args since --auto_layout changes them per sheet
+    sheet_args = {sheet: argparse.Namespace(**{**vars(args), "sheet": sheet}) for sheet in sheets}
+    setups = {}
+    timings = {}
+    for sheet in sheets:
+        print(f"[INFO] Setting up {sheet}")
+        start = time.perf_counter()
+        template_details, template_panel = setup_panels(
+            sheet_args[sheet], create_dirs(sheet), writer_threads=0)
+        template_details.writer = writer
+        setups[sheet] = (template_details, template_panel)
+        timings[sheet] = {"setup": time.perf_counter() - start, "rendered": 0, "render": 0.0, "done": 0.0}
+
+    manifests = {}
+
+    def batch_rows() -> Generator[tuple[str, tuple, RowStats]]:
+        for sheet in sheets:
+            template_details = setups[sheet][0]
+            use_sheet(template_details)
+            save_path = template_details.base_path
+            old_manifest = {} if getattr(args, "force", False) else load_manifest(save_path)
+            manifest = {}
+            manifests[sheet] = (old_manifest, manifest)
+            rows = plan_rows(with_row_stats(iter_song_rows(sheet), template_details),
+                             template_details, sheet_args[sheet], old_manifest, manifest)
+            for row, row_stats in rows:
+                yield (sheet, row, row_stats)
+
+    def finish_row(sheet: str, elapsed: float) -> None:
+        timings[sheet]["rendered"] += 1
+        timings[sheet]["render"] += elapsed
+        timings[sheet]["done"] = time.perf_counter() - batch_start
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_batch_worker,
+                                 initargs=(sheet_args, profiler.enabled)) as pool:
+            for sheet, elapsed, events in pool.map(render_batch_row, batch_rows()):
+                profiler.add(events)
+                finish_row(sheet, elapsed)
+    else:
+        for sheet, row, row_stats in batch_rows():
+            start = time.perf_counter()
+            template_details, template_panel = setups[sheet]
+            use_sheet(template_details)
+            create_song_panel(row, template_details, template_panel, row_stats)
+            finish_row(sheet, time.perf_counter() - start)
+    writer.close()
+
+    for sheet in sheets:
+        save_path = setups[sheet][0].base_path
+        old_manifest, manifest = manifests[sheet]
+        remove_stale_panels(save_path, old_manifest, manifest)
+        save_manifest(save_path, manifest)
+        timings[sheet]["total"] = len(manifest)
+
+    print(f"[INFO] Rendered {len(sheets)} sheets in {time.perf_counter() - batch_start:.2f} s")
+    print(f"{'Sheet':<30}{'Setup (s)':>10}{'Panels':>10}{'Render (s)':>12}{'Done at (s)':>13}")
+    for sheet in sheets:
+        timing = timings[sheet]
+        panels = f"{timing['rendered']}/{timing['total']}"
+        print(f"{os.path.basename(sheet):<30}{timing['setup']:>10.2f}{panels:>10}"
+              f"{timing['render']:>12.2f}{timing['done']:>13.2f}")
+    if profile_path:
+        profiler.report()
+        profiler.write_trace(profile_path)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Generate video panels from spreadsheet.')
-    parser.add_argument('sheet', type=str, help='Path to the Excel sheet')
+    parser.add_argument('sheet', type=str,
+                        help='Path to the Excel sheet or a CSV export of it. A directory or glob pattern '
+                             '(quoted, e.g. "PRs/*.xlsx") renders every sheet in it on one worker pool')
     parser.add_argument("-i", '--inside_box', type=int, nargs='?',
                         default=0, help='Number of people inside the video box')
     parser.add_argument("-m", '--mode', type=str, choices=[
@@ -586,9 +1441,67 @@ if __name__ == '__main__':
     parser.add_argument("-s", '--single_sided', type=str, choices=['off',
                         'left', 'right'], default='off', help='Single sided mode')
     parser.add_argument("-d", '--dartboard', type=int, default=None, help='Sheet index of guesses for dartboard')
+    parser.add_argument('--auto_layout', action="store_true",
+                        help='Pick the avatar size, columns, padding, inside box count and sides that fit the most people '
+                             'at the largest size, instead of the settings at the top of the file')
+    parser.add_argument("-w", '--workers', type=int, default=1,
+                        help='Number of processes to render panels with. 1 renders serially')
+    parser.add_argument('--no_static_layer', action="store_true",
+                        help='Draw every avatar on each panel instead of baking them into the template once')
+    parser.add_argument('--format', type=str, choices=FORMATS, default='png',
+                        help='Image format to write panels as. tga and ppm are uncompressed and faster to write')
+    parser.add_argument('--compress_level', type=int, choices=range(0, 10), default=None,
+                        help='PNG zlib level, 0 (fastest, largest) to 9 (slowest, smallest)')
+    parser.add_argument('--drop_alpha', action="store_true",
+                        help='Write panels without an alpha channel when they are fully opaque')
+    parser.add_argument('--writer_threads', type=int, default=2,
+                        help='Threads encoding and writing panels while the next ones render. 0 writes inline')
+    parser.add_argument('--video', type=str, default=None,
+                        help='Write the panels, ordered by rank, to this video file through ffmpeg instead of as images')
+    parser.add_argument('--countdown', action="store_true",
+                        help='Order the video from the last rank to first')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='Seconds each panel is shown in the video when the sheet has no duration column')
+    parser.add_argument('--fps', type=float, default=10,
+                        help='Frame rate of the video. Durations are rounded to whole frames')
+    parser.add_argument('--lossless', action="store_true",
+                        help='Write a lossless FFV1 video (use a .mkv file) to edit further instead of H.264')
+    parser.add_argument('--profile', type=str, nargs='?', const='', default=None,
+                        help='Time each stage of setup and rendering, print a table and write a Chrome trace '
+                             '(chrome://tracing or ui.perfetto.dev) to this path, or profile_trace.json in the panels folder')
+    parser.add_argument('--preview', type=float, nargs='?', const=0.5, default=None,
+                        help='Quickly render a few panels at this fraction of the full size (0.5 if not given) '
+                             'to a preview folder, leaving the full size panels alone')
+    parser.add_argument('--preview_rows', type=int, default=6,
+                        help='Number of rows --preview renders')
+    parser.add_argument('--preview_sample', action="store_true",
+                        help='Preview rows spread across the whole sheet instead of the first ones')
+    parser.add_argument('--contact_sheet', action="store_true",
+                        help='Also tile the preview panels into one contact_sheet.png')
+    parser.add_argument('--watch', action="store_true",
+                        help='Stay running and re-render the panels whenever the sheet, avatars, fonts or template files '
+                             'change. Everything is kept loaded, so only the changed rows are rendered again')
+    parser.add_argument("-f", '--force', action="store_true",
+                        help='Re-render every panel even if its row has not changed since the last run')
 
+    args = parser.parse_args()
     if args.mode == "dartboard" and args.dartboard is None:
         parser.error("--dartboard must be provided when mode is 'dartboard'")
-
-    args = parser.parse_args()
-    main(args)
+    if args.preview is not None and not 0 < args.preview <= 1:
+        parser.error("--preview must be between 0 and 1")
+    if is_batch(args.sheet):
+        if args.video:
+            parser.error("--video takes a single sheet")
+        if args.preview is not None or args.watch:
+            parser.error("--preview and --watch take a single sheet")
+        main_batch(args)
+    elif args.preview is not None:
+        if args.video:
+            parser.error("--preview writes images, not a video")
+        main_preview(args)
+    elif args.watch:
+        if args.video:
+            parser.error("--watch writes images, not a video")
+        main_watch(args)
+    else:
+        main(args)
@@ -0,0 +1,115 @@
+import functools
+from typing import Optional
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from font_cache import get_font
+
+# Characters scores and counts are made of. Text with anything else falls back to ImageDraw.text
+NUMERIC_GLYPHS = "0123456789.-"
+
+
+class GlyphAtlas:
+    """Draws numbers from glyph masks rasterized once, instead of asking FreeType to lay out and
+    rasterize every score and count on every panel. Glyphs are kept per 1/64 pixel offset, the precision
+    FreeType positions them at, and placed with the font's advances and kerning, so the result is the
+    same as ImageDraw.text with the same font, anchor and stroke"""
+    def __init__(self, font: ImageFont.FreeTypeFont, stroke_width: float = 0, alphabet: str = NUMERIC_GLYPHS):
+        self.font = font
+        self.stroke_width = stroke_width
+        self.advances = {char: font.getlength(char) for char in alphabet}
+        self.kerning = {}
+        for first in alphabet:
+            for second in alphabet:
+                kern = font.getlength(first + second) - self.advances[first] - self.advances[second]
+                if kern:
+                    self.kerning[(first, second)] = kern
+        self.ascender, self.descender = font.getmetrics()
+        self.glyphs: dict[tuple[str, float, int, int], tuple[Optional[Image.Image], tuple[int, int]]] = {}
+
+    def supports(self, text: str) -> bool:
+        return all(char in self.advances for char in text)
+
+    def pen_positions(self, text: str) -> list[float]:
+        positions = []
+        x = 0.0
+        for i, char in enumerate(text):
+            if i:
+                x += self.kerning.get((text[i - 1], char), 0)
+            positions.append(x)
+            x += self.advances[char]
+        return positions
+
+    def glyph(self, char: str, stroke_width: float, x_64: int, y_64: int) -> tuple[Optional[Image.Image], tuple[int, int]]:
+        """Mask of char starting x_64 / 64 and y_64 / 64 pixels past a whole pixel, and where it goes from there"""
+        key = (char, stroke_width, x_64, y_64)
+        if key not in self.glyphs:
+            core, offset = self.font.getmask2(char, "L", stroke_width=stroke_width, anchor="ls",
+                                              start=(x_64 / 64, y_64 / 64), stroke_filled=True)
+            mask = Image.frombytes("L", core.size, bytes(core)) if core.size[0] and core.size[1] else None
+            self.glyphs[key] = (mask, offset)
+        return self.glyphs[key]
+
+    def draw(self, image: Image.Image, xy: tuple[float, float], text: str, fill, anchor: str = "la",
+             stroke_fill=None) -> None:
+        """Like ImageDraw.Draw(image).text(xy, text, fill, font, anchor, stroke_width, stroke_fill)"""
+        if not self.supports(text):
+            ImageDraw.Draw(image).text(xy, text, font=self.font, fill=fill, anchor=anchor,
+                                       stroke_width=self.stroke_width, stroke_fill=stroke_fill)
+            return
+        pens = self.pen_positions(text)
+        width = pens[-1] + self.advances[text[-1]] if text else 0
+        horizontal, vertical = anchor
+        # Like FreeType, the anchor is rounded to whole pixels and only the fraction of xy is drawn at a subpixel offset
+        x = xy[0] - round_pixel({"l": 0, "m": width / 2, "r": width}[horizontal])
+        baseline = xy[1] + round_pixel({"a": self.ascender, "m": (self.ascender - self.descender) / 2,
+                                        "s": 0, "d": -self.descender}[vertical])
+
+        layers = [(0, fill)]
+        if self.stroke_width:
+            stroke_fill = fill if stroke_fill is None else stroke_fill
+            # ImageDraw.text skips the fill when it is the same color as the stroke
+            same = color_value(fill, image.mode) == color_value(stroke_fill, image.mode)
+            layers = [(self.stroke_width, stroke_fill)] + ([] if same else layers)
+        y_pixel, y_64 = divmod(round(baseline * 64), 64)
+        for stroke_width, ink in layers:
+            placed = []
+            for char, pen in zip(text, pens):
+                x_pixel, x_64 = divmod(round((x + pen) * 64), 64)
+                mask, offset = self.glyph(char, stroke_width, x_64, y_64)
+                if mask is not None:
+                    placed.append((mask, x_pixel + offset[0], y_pixel + offset[1]))
+            if not placed:
+                continue
+            if len(placed) == 1:
+                mask, left, top = placed[0]
+                image.paste(ink, (left, top, left + mask.width, top + mask.height), mask)
+                continue
+            # Neighbouring glyphs can overlap, so they are merged into one mask first and the ink is blended once.
+            # Overlaps add up the way FreeType's renderer does it in Pillow: a + b - a * b / 255, rounded
+            left = min(glyph_left for _, glyph_left, _ in placed)
+            top = min(glyph_top for _, _, glyph_top in placed)
+            right = max(glyph_left + glyph_mask.width for glyph_mask, glyph_left, _ in placed)
+            bottom = max(glyph_top + glyph_mask.height for glyph_mask, _, glyph_top in placed)
+            text_mask = np.zeros((bottom - top, right - left), dtype=np.int32)
+            for glyph_mask, glyph_left, glyph_top in placed:
+                region = text_mask[glyph_top - top:glyph_top - top + glyph_mask.height,
+                                   glyph_left - left:glyph_left - left + glyph_mask.width]
+                coverage = np.asarray(glyph_mask, dtype=np.int32)
+                product = region * coverage + 128
+                region += coverage - ((product + (product >> 8)) >> 8)
+            image.paste(ink, (left, top, right, bottom), Image.fromarray(text_mask.astype(np.uint8), "L"))
+
+
+def round_pixel(value: float) -> int:
+    """Rounds half up, as FreeType's 26.6 fixed point does"""
+    return (round(value * 64) + 32) >> 6
+
+
+def color_value(color, mode: str):
+    return ImageColor.getcolor(color, mode) if isinstance(color, str) else color
+
+
+@functools.lru_cache(maxsize=None)
+def glyph_atlas(path: str, size: float, stroke_width: float = 0) -> GlyphAtlas:
+    """Process-wide atlas per font file, size and stroke width"""
+    return GlyphAtlas(get_font(path, size), stroke_width)
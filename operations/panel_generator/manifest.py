@@ -0,0 +1,41 @@
+import json
+import os
+from typing import Optional
+
+# Written to every panels folder: panel file name -> hash of everything its panel was rendered from
+MANIFEST_NAME = "manifest.json"
+
+
+def load_manifest(save_path: str) -> dict:
+    path = os.path.join(save_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(save_path: str, manifest: dict) -> None:
+    with open(os.path.join(save_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def remove_stale_panels(save_path: str, old_manifest: dict, manifest: dict) -> None:
+    """Deletes the panels of rows that were in the last run's manifest but aren't in this one"""
+    for filename in old_manifest.keys() - manifest.keys():
+        path = os.path.join(save_path, filename)
+        if os.path.exists(path):
+            print(f"[INFO] Removing {filename}, its row is no longer in the sheet")
+            os.remove(path)
+
+
+def file_stamps(paths: list[str]) -> dict[str, Optional[tuple[int, int]]]:
+    """(modification time, size) of every path, None if it is missing. Cheap enough to check assets on every run
+    without reading them"""
+    stamps = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamps[path] = None
+    return stamps
@@ -0,0 +1,65 @@
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+Box = list[tuple[float, float]]
+
+
+@dataclass(frozen=True)
+class PanelLayout:
+    """Where everything goes on a panel, worked out once per template after the frame is sized.
+    Rendering only reads from this. Positions are in background pixels, boxes are text centers"""
+    background_size: tuple[int, int]
+    frame_size: tuple[int, int]
+    offset: tuple[int, int]
+    # left, right, top, bottom of the video frame
+    frame_pos: tuple[int, int, int, int]
+    boxes: dict[str, tuple[float, float]]
+    anchors: dict[str, tuple[float, float]]
+    avatar_slots: tuple[tuple[int, int], ...] = ()
+    # Per avatar slot, keyed like anchors
+    slot_anchors: dict[str, tuple[tuple[float, float], ...]] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def frame_layout(background_size: tuple[int, int], frame_size: tuple[int, int], offset: tuple[int, int],
+                 positions: dict[str, Box], **kwargs) -> PanelLayout:
+    """Layout with the frame at offset and the centers of the boxes at positions, plus any other fields"""
+    offset = (int(offset[0]), int(offset[1]))
+    return PanelLayout(
+        background_size=tuple(background_size),
+        frame_size=tuple(frame_size),
+        offset=offset,
+        frame_pos=(offset[0], offset[0] + frame_size[0], offset[1], offset[1] + frame_size[1]),
+        boxes=box_centers(offset, frame_size, positions),
+        **kwargs)
+
+
+def box_positions_path(frame_path: str) -> str:
+    return os.path.splitext(frame_path)[0] + ".json"
+
+
+def load_box_positions(frame_path: str, defaults: dict[str, Box]) -> dict[str, Box]:
+    """Box positions for a frame, as fractions of its size. A "<frame name>.json" next to the frame image,
+    like {"rank": [[left, top], [right, bottom]]}, overrides the defaults so frames can be swapped without code edits"""
+    positions = dict(defaults)
+    path = box_positions_path(frame_path)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for name, box in json.load(f).items():
+                if name not in positions:
+                    raise KeyError(f"Unknown box {name} in {path}, expected one of {sorted(positions)}")
+                positions[name] = [tuple(corner) for corner in box]
+    return positions
+
+
+def box_centers(offset: tuple[int, int], frame_size: tuple[int, int],
+                positions: dict[str, Box]) -> dict[str, tuple[float, float]]:
+    vf_w, vf_h = frame_size
+    return {
+        name: (offset[0] + (box[0][0] * vf_w + box[1][0] * vf_w) / 2,
+               offset[1] + (box[0][1] * vf_h + box[1][1] * vf_h) / 2)
+        for name, box in positions.items()
+    }
@@ -0,0 +1,125 @@
+import math
+import subprocess
+import threading
+from collections.abc import Iterable
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+from profiler import profiler
+
+# Formats panels can be written as. TGA and PPM are uncompressed, so they are fast to write and for editors to read
+FORMATS = ["png", "tga", "ppm"]
+
+
+class PanelWriter:
+    """Encodes and writes panels on background threads so rendering the next panel doesn't wait on zlib.
+    At most queue_size panels are waiting to be written at once, which keeps memory bounded.
+    With threads=0 every panel is written before save returns"""
+    def __init__(self,
+                 image_format: str = "png",
+                 compress_level: Optional[int] = None,
+                 drop_alpha: bool = False,
+                 threads: int = 2,
+                 queue_size: int = 8):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported format: {image_format}")
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.drop_alpha = drop_alpha
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.pending: list[Future] = []
+
+    @property
+    def extension(self) -> str:
+        return self.image_format
+
+    def options(self) -> tuple:
+        """Everything that changes the bytes written for a panel"""
+        return (self.image_format, self.compress_level, self.drop_alpha)
+
+    def save(self, panel: Image.Image, save_path: str) -> None:
+        if self.pool is None:
+            self._write(panel, save_path)
+            return
+        self.slots.acquire()
+        future = self.pool.submit(self._write, panel, save_path)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.pending = [f for f in self.pending if not f.done() or f.exception()]
+        self.pending.append(future)
+
+    def flush(self) -> None:
+        """Waits for every queued panel to be written and re-raises the first error, keeping the threads for more"""
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self) -> None:
+        """Waits for every queued panel to be written and re-raises the first error"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.flush()
+
+    def _write(self, panel: Image.Image, save_path: str) -> None:
+        with profiler.stage("save"):
+            self._encode(panel, save_path)
+
+    def _encode(self, panel: Image.Image, save_path: str) -> None:
+        if self.image_format == "ppm":
+            # PPM has no alpha channel
+            panel = panel.convert("RGB")
+        elif self.drop_alpha and panel.mode == "RGBA" and panel.getextrema()[3] == (255, 255):
+            panel = panel.convert("RGB")
+
+        if self.image_format == "png":
+            # None keeps Pillow's default zlib level
+            options = {} if self.compress_level is None else {"compress_level": self.compress_level}
+            panel.save(save_path, format="PNG", **options)
+        elif self.image_format == "tga":
+            panel.save(save_path, format="TGA")
+        else:
+            panel.save(save_path, format="PPM")
+
+
+class VideoWriter:
+    """Streams raw RGBA panels into an ffmpeg process instead of writing image files.
+    Durations are rounded to whole frames at fps. Each panel is piped once per step frames, step being the largest
+    number of frames every duration is a multiple of, and ffmpeg repeats it up to fps. A sheet of 5 s panels at
+    10 fps sends every panel once instead of 50 times"""
+    def __init__(self, out_path: str, size: tuple[int, int], durations: Iterable[float], fps: float = 10,
+                 lossless: bool = False):
+        self.out_path = out_path
+        self.size = size
+        self.fps = fps
+        self.step = math.gcd(*(self.frame_count(duration) for duration in durations)) or 1
+        if lossless:
+            codec = ["-c:v", "ffv1", "-pix_fmt", "bgra"]
+        else:
+            codec = ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "18", "-tune", "stillimage"]
+        self.process = subprocess.Popen([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba",
+            "-s", f"{size[0]}x{size[1]}", "-r", f"{fps}/{self.step}",
+            "-i", "-",
+            "-r", str(fps),
+            *codec,
+            out_path
+        ], stdin=subprocess.PIPE)
+        self.frames = 0
+
+    def frame_count(self, duration: float) -> int:
+        return max(1, round(duration * self.fps))
+
+    def add(self, frame: bytes, duration: float) -> None:
+        count = self.frame_count(duration)
+        for _ in range(count // self.step):
+            self.process.stdin.write(frame)
+        self.frames += count
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with code {returncode}")
+        print(f"[INFO] Wrote {self.frames / self.fps:.1f} s of video to {self.out_path}")
@@ -1,21 +1,42 @@
 import argparse
 from dataclasses import dataclass
+import difflib
+import hashlib
 import itertools
+import json
 import os
 import math
 import re
+import unicodedata
 from typing import Optional
-import openpyxl
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageChops
-from collections.abc import Generator
+from PIL import Image, ImageDraw, ImageChops
+from font_cache import get_font, fit_font, truncate_to_width
+from glyph_atlas import glyph_atlas
+from sheet_reader import iter_sheet_rows
+from panel_writer import PanelWriter
+from manifest import file_stamps, load_manifest, remove_stale_panels, save_manifest
+from profiler import profiler, trace_path
+from panel_layout import PanelLayout, box_positions_path, frame_layout, load_box_positions
+from collections.abc import Generator, Iterable
 
 # Settings
 BG_PATH = './Template/genshin_bg.png'
 FRAME_PATH = './Template/seasons_frame.png'
 AVATAR_PATH = './avatars'
 HONORABLE_PATH = './honorables'
+# Album art for an honorable mention is the image in HONORABLE_PATH named after its song. Names are compared
+# ignoring case, spaces and punctuation, and failing that the closest name at least this similar (0 to 1) is used
+ALBUM_ART_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+ALBUM_ART_MATCH_CUTOFF = 0.8
 SAVE_PATH = "./PR"
+# Rendered templates and their count positions are kept here between runs. Bump TEMPLATE_VERSION whenever
+# create_template draws something differently, so templates cached by the old code aren't used
+TEMPLATE_CACHE_PATH = './Template/.cache'
+TEMPLATE_VERSION = 1
+# Whose avatar and name go next to the frame. Their avatar is AVATAR_PATH/<name>.png
+HOST_NAME = "Potato"
 AVATAR_SIZE = 120
 ALBUM_ART_SIZE = 120
 FRAME_RIGHT_PADDING = 20
@@ -42,28 +63,97 @@ class FontStyles:
     @staticmethod
     def load_fonts():
         return {
-            "song": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=36),
-            "score": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=36),
-            "anime": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=34),
-            "type": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=30),
-            "season": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=30),
-            "year": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=30),
-            "remaining_hms": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=24.03),
-            "tokens": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=48.06),
-            "name": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=24),
-            "count_info": ImageFont.truetype("Fonts/Montserrat-Semibold.ttf", size=24.03)
+            "song": get_font("Fonts/Montserrat-Semibold.ttf", 36),
+            "score": get_font("Fonts/Montserrat-Semibold.ttf", 36),
+            "anime": get_font("Fonts/Montserrat-Semibold.ttf", 34),
+            "type": get_font("Fonts/Montserrat-Semibold.ttf", 30),
+            "season": get_font("Fonts/Montserrat-Semibold.ttf", 30),
+            "year": get_font("Fonts/Montserrat-Semibold.ttf", 30),
+            "remaining_hms": get_font("Fonts/Montserrat-Semibold.ttf", 24.03),
+            "tokens": get_font("Fonts/Montserrat-Semibold.ttf", 48.06),
+            "name": get_font("Fonts/Montserrat-Semibold.ttf", 24),
+            "count_info": get_font("Fonts/Montserrat-Semibold.ttf", 24.03)
         }
 
 
+def normalize_name(name: str) -> str:
+    return re.sub(r'[\W_]+', '', unicodedata.normalize("NFKC", str(name)).casefold())
+
+
+def honorable_song(honorable) -> str:
+    """Song name of an honorable mention written as '<song> by <artist>'"""
+    return str(honorable).split(" by ")[0].strip()
+
+
+class AlbumArt:
+    """Honorable mention album art. HONORABLE_PATH is listed once, each song is matched to a file once
+    and each image is decoded and resized once per process, so panels don't touch the disk for it"""
+    def __init__(self, folder: str = HONORABLE_PATH, matches: Optional[dict[str, Optional[str]]] = None):
+        self.folder = folder
+        # Normalized file name -> path
+        self.index = {}
+        # Normalized song name -> path, or None without album art
+        self.matches = dict(matches or {})
+        self.images = {}
+        if matches is None and os.path.isdir(folder):
+            for entry in sorted(os.listdir(folder)):
+                stem, extension = os.path.splitext(entry)
+                if extension.lower() in ALBUM_ART_EXTENSIONS:
+                    self.index.setdefault(normalize_name(stem), os.path.join(folder, entry))
+
+    def find(self, song: str) -> Optional[str]:
+        key = normalize_name(song)
+        if key not in self.matches:
+            path = self.index.get(key)
+            if path is None:
+                close = difflib.get_close_matches(key, list(self.index), n=1, cutoff=ALBUM_ART_MATCH_CUTOFF)
+                path = self.index[close[0]] if close else None
+            self.matches[key] = path
+        return self.matches[key]
+
+    def match(self, songs: Iterable[str]) -> list[str]:
+        """Matches every song to its file up front. Returns the songs without album art"""
+        return sorted({song for song in songs if self.find(song) is None})
+
+    def stamp(self, song: str) -> Optional[tuple[str, int, int]]:
+        """Which file a song's album art comes from and its version, for the manifest"""
+        path = self.find(song)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def image(self, song: str) -> Image.Image:
+        """Album art at ALBUM_ART_SIZE, black if the song has none"""
+        path = self.find(song)
+        if path not in self.images:
+            if path is None:
+                self.images[path] = Image.new('RGBA', (ALBUM_ART_SIZE, ALBUM_ART_SIZE), (0, 0, 0, 255))
+            else:
+                with Image.open(path) as source:
+                    self.images[path] = source.convert("RGBA").resize((ALBUM_ART_SIZE, ALBUM_ART_SIZE))
+        return self.images[path]
+
+
 class PanelInfo:
-    def __init__(self, info_dict: dict, save_path: str, name):
+    def __init__(self, info_dict: dict, save_path: str, name, album_art_matches: Optional[dict] = None):
         self.index_dict = info_dict
         self.base_path = save_path
         self.fonts = FontStyles.load_fonts()
+        # Counts are drawn from pre-rendered glyphs
+        self.count_atlas = glyph_atlas(self.fonts["count_info"].path, self.fonts["count_info"].size)
+        self.tokens_atlas = glyph_atlas(self.fonts["tokens"].path, self.fonts["tokens"].size)
 
         self.background = Image.open(BG_PATH)
         self.video_frame = Image.open(FRAME_PATH)
-        self.name = "Potato"
+        self.name = name
+        # Given the songs already matched to album art, HONORABLE_PATH isn't listed again
+        self.album_art = AlbumArt(matches=album_art_matches)
+        self.writer = PanelWriter()
+        self.box_positions = load_box_positions(FRAME_PATH, {
+            "year": YEAR_POSITION, "season": SEASON_POSITION, "type": TYPE_POSITION, "score": SCORE_POSITION})
+        # Built at the end of create_template, once the count positions are known
+        self.layout: Optional[PanelLayout] = None
 
         self.positions = {
             "hm_count": None,
@@ -97,6 +187,63 @@ class PanelInfo:
                 raise KeyError(f"Invalid position key: {key}")
 
 
+def template_key(template_details: PanelInfo) -> str:
+    """Hash of everything drawn into the template: the background, frame, fonts, host avatar and name, the sizes
+    and TEMPLATE_VERSION for the drawing code itself. Files are keyed on their modification time and size, as in
+    generate_panels, so they aren't read"""
+    digest = hashlib.sha1()
+    paths = [BG_PATH, FRAME_PATH, box_positions_path(FRAME_PATH),
+             os.path.join(AVATAR_PATH, f"{template_details.name}.png")]
+    paths += sorted({font.path for font in template_details.fonts.values()})
+    for path, stamp in file_stamps(paths).items():
+        digest.update(f"{path}:{stamp}\n".encode())
+    settings = (TEMPLATE_VERSION, template_details.name, AVATAR_SIZE, FRAME_RIGHT_PADDING,
+                {name: font.size for name, font in template_details.fonts.items()})
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
+
+
+def load_template(template_details: PanelInfo) -> Image.Image:
+    """The template from the on-disk cache if nothing it is drawn from changed, otherwise drawn and cached.
+    Either way template_details gets its count positions and layout"""
+    key = template_key(template_details)
+    image_path = os.path.join(TEMPLATE_CACHE_PATH, f"seasons_{key}.npy")
+    positions_path = os.path.join(TEMPLATE_CACHE_PATH, f"seasons_{key}.json")
+    if os.path.exists(image_path) and os.path.exists(positions_path):
+        try:
+            with open(positions_path, "r", encoding="utf-8") as f:
+                positions = json.load(f)
+            template_image = Image.fromarray(np.load(image_path), "RGBA")
+            template_details.set_pos(**{name: tuple(pos) for name, pos in positions.items()})
+            template_details.layout = build_layout(template_details)
+            return template_image
+        except (OSError, ValueError, KeyError, TypeError):
+            print(f"[WARNING] Template cache {image_path} is unreadable, drawing the template again")
+
+    template_image = create_template(template_details)
+    os.makedirs(TEMPLATE_CACHE_PATH, exist_ok=True)
+    # Written under temporary names and swapped in, so a parallel run never reads half a file
+    for path, write in ((image_path, lambda f: np.save(f, np.asarray(template_image))),
+                        (positions_path, lambda f: f.write(json.dumps(template_details.positions).encode()))):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+    remove_stale_templates(key)
+    return template_image
+
+
+def remove_stale_templates(key: str) -> None:
+    """Deletes the cached templates of every other key, which only a change back to older inputs would use again"""
+    for name in os.listdir(TEMPLATE_CACHE_PATH):
+        match = re.fullmatch(r"seasons_([0-9a-f]+)\.(npy|json)", name)
+        if match and match.group(1) != key:
+            try:
+                os.remove(os.path.join(TEMPLATE_CACHE_PATH, name))
+            except FileNotFoundError:
+                pass
+
+
 def create_template(template_details: PanelInfo) -> Image.Image:
     frame_pos = template_details.frame_pos
     bg_w, bg_h = template_details.background.size
@@ -109,7 +256,12 @@ def create_template(template_details: PanelInfo) -> Image.Image:
     start_x = (frame_pos[0] - AVATAR_SIZE) // 2
     start_y = frame_pos[2]
     path = os.path.join(AVATAR_PATH, f"{template_details.name}.png")
-    avatar = Image.open(path).resize((AVATAR_SIZE, AVATAR_SIZE))
+    with profiler.stage("avatar load"):
+        try:
+            avatar = Image.open(path).resize((AVATAR_SIZE, AVATAR_SIZE))
+        except FileNotFoundError:
+            print(f"[WARNING] Could not find image for {template_details.name}")
+            avatar = Image.new('RGBA', (AVATAR_SIZE, AVATAR_SIZE), (0, 0, 0, 255))
     template_image.paste(avatar, (start_x, start_y))
 
     draw.text(
@@ -212,10 +364,26 @@ def create_template(template_details: PanelInfo) -> Image.Image:
         male_count=(line_end_x - 15,  male_y_pos),
         female_count=(line_end_x - 15, female_y_pos),
         both_count=(line_end_x - 15, both_y_pos))
-
+    template_details.layout = build_layout(template_details)
     return template_image
 
 
+def build_layout(template_details: PanelInfo) -> PanelLayout:
+    """Where write_song_info, write_count_info and write_honorables draw, once the count positions are set"""
+    bg_w, bg_h = template_details.background.size
+    vf_w, vf_h = template_details.video_frame.size
+    offset = template_details.offset
+    frame_pos = template_details.frame_pos
+    return frame_layout(
+        (bg_w, bg_h), (vf_w, vf_h), offset, template_details.box_positions,
+        anchors={
+            "anime": (offset[0] + vf_w / 2, offset[1] / 2),
+            "song": (offset[0] + vf_w / 2, (bg_h + offset[1] + vf_h) / 2),
+            "album_art": (frame_pos[0] + 10, frame_pos[3] - AVATAR_SIZE - 30),
+            **template_details.positions,
+        })
+
+
 def create_song_panel(
     row: tuple,
     template_details: PanelInfo,
@@ -224,19 +392,26 @@ def create_song_panel(
     index_dict = template_details.index_dict
     panel = template_panel.copy()
     song_info = {key: row[index_dict[key]] for key in list(index_dict.keys())}
-    season = song_info['season']
-    write_song_info(song_info, panel, template_details)
-    write_count_info(song_info, panel, template_details)
-    write_honorables(song_info, panel, template_details)
+    with profiler.stage("song info"):
+        write_song_info(song_info, panel, template_details)
+    with profiler.stage("count info"):
+        write_count_info(song_info, panel, template_details)
+    with profiler.stage("honorables"):
+        write_honorables(song_info, panel, template_details)
+    save_path = os.path.join(template_details.base_path,
+                             panel_filename(row, index_dict, template_details.writer.extension))
+    template_details.writer.save(panel, save_path)
+
+
+def panel_filename(row: tuple, index_dict: dict, extension: str = "png") -> str:
     season_dict = {
         "Winter": "1",
         "Spring": "2",
         "Summer": "3",
         "Fall": "4"
     }
-    save_path = os.path.join(template_details.base_path,
-                             f"panel_{int(song_info['year'])}_{season_dict[season]}_{season}.png")
-    panel.save(save_path)
+    season = row[index_dict["season"]]
+    return f"panel_{int(row[index_dict['year']])}_{season_dict[season]}_{season}.{extension}"
 
 
 def write_song_info(
@@ -244,9 +419,9 @@ def write_song_info(
     panel: Image.Image,
     template_details: PanelInfo
 ) -> None:
-    offset = template_details.offset
-    bg_w, bg_h = template_details.background.size
-    vf_w, vf_h = template_details.video_frame.size
+    layout = template_details.layout
+    offset = layout.offset
+    vf_w, vf_h = layout.frame_size
 
     song_name = str(song_info["song_info"])
     anime_name = str(song_info["anime"])
@@ -256,35 +431,27 @@ def write_song_info(
     score = song_info["score"]
 
     draw = ImageDraw.Draw(panel)
-    song_font = template_details.fonts["song"]
-    anime_font = template_details.fonts["anime"]
+    # The anime name is drawn with the song font and vice versa
+    song_font = fit_font(anime_name, template_details.fonts["song"], vf_w)
+    anime_font = fit_font(song_name, template_details.fonts["anime"], vf_w)
 
     draw.rectangle(
         ((offset), (offset[0] + vf_w, offset[1] + vf_h)), outline=(193, 193, 193), width=1)
-    draw.text((offset[0] + vf_w / 2, offset[1] / 2), anime_name, font=song_font,
+    draw.text(layout.anchors["anime"], anime_name, font=song_font,
               fill='white', stroke_width=1, stroke_fill='black', anchor="mm")
-    draw.text((offset[0] + vf_w / 2, (bg_h + offset[1] + vf_h) / 2), song_name, font=anime_font,
+    draw.text(layout.anchors["song"], song_name, font=anime_font,
               fill='white', stroke_width=1, stroke_fill='black', anchor="mm")
 
-    year_box_center = (offset[0] + (YEAR_POSITION[0][0] * vf_w + YEAR_POSITION[1][0] * vf_w) / 2,
-                       offset[1] + (YEAR_POSITION[0][1] * vf_h + YEAR_POSITION[1][1] * vf_h) / 2)
-    season_box_center = (offset[0] + (SEASON_POSITION[0][0] * vf_w + SEASON_POSITION[1][0] * vf_w) / 2,
-                         offset[1] + (SEASON_POSITION[0][1] * vf_h + SEASON_POSITION[1][1] * vf_h) / 2)
-    type_box_center = (offset[0] + (TYPE_POSITION[0][0] * vf_w + TYPE_POSITION[1][0] * vf_w) / 2,
-                       offset[1] + (TYPE_POSITION[0][1] * vf_h + TYPE_POSITION[1][1] * vf_h) / 2)
-    score_box_center = (offset[0] + (SCORE_POSITION[0][0] * vf_w + SCORE_POSITION[1][0] * vf_w) / 2,
-                        offset[1] + (SCORE_POSITION[0][1] * vf_h + SCORE_POSITION[1][1] * vf_h) / 2)
-
-    draw.text(year_box_center, year,
+    draw.text(layout.boxes["year"], year,
               font=template_details.fonts["year"], fill=(59, 60, 67),
               stroke_width=0, stroke_fill='black', anchor="mm")
-    draw.text(season_box_center, season,
+    draw.text(layout.boxes["season"], season,
               font=template_details.fonts["season"], fill=(59, 60, 67),
               stroke_width=0, stroke_fill='black', anchor="mm")
-    draw.text(type_box_center, song_type,
+    draw.text(layout.boxes["type"], song_type,
               font=template_details.fonts["type"], fill=(59, 60, 67),
               stroke_width=0, stroke_fill='black', anchor="mm")
-    draw.text(score_box_center, score,
+    draw.text(layout.boxes["score"], score,
               font=template_details.fonts["score"], fill=(59, 60, 67),
               stroke_width=0, stroke_fill='black', anchor="mm")
 
@@ -294,31 +461,10 @@ def write_count_info(
     panel: Image.Image,
     template_details: PanelInfo
 ):
-    positions = template_details.positions
-    draw = ImageDraw.Draw(panel)
-    count_font = template_details.fonts["count_info"]
-    hm_font = template_details.fonts["tokens"]
-    draw.text(positions["hm_count"], str(int(song_info["tokens"])),
-              font=hm_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["op_count"], str(int(song_info["op_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["ed_count"], str(int(song_info["ed_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["in_count"], str(int(song_info["in_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["male_count"], str(int(song_info["male_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["female_count"], str(int(song_info["female_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
-    draw.text(positions["both_count"], str(int(song_info["both_count"])),
-              font=count_font, fill="white", anchor='ma',
-              stroke_width=0, stroke_fill='black')
+    positions = template_details.layout.anchors
+    template_details.tokens_atlas.draw(panel, positions["hm_count"], str(int(song_info["tokens"])), "white", anchor='ma')
+    for key in ("op_count", "ed_count", "in_count", "male_count", "female_count", "both_count"):
+        template_details.count_atlas.draw(panel, positions[key], str(int(song_info[key])), "white", anchor='ma')
 
 
 def write_honorables(
@@ -328,21 +474,11 @@ def write_honorables(
 ):
     honorable = song_info["honorables"]
     if honorable is not None and honorable != "":
-        split = str(honorable).split("by")
-        # try:
-        #     path = os.path.join(HONORABLE_PATH, f"{song_name}.png")
-        #     album_art = Image.open(path).resize(
-        #         (AVATAR_SIZE, AVATAR_SIZE))
-        # except FileNotFoundError:
-        #     print(f"[WARNING] Could not find image for {song_name}")
-        album_art = Image.new(
-            'RGBA', (ALBUM_ART_SIZE, ALBUM_ART_SIZE), (0, 0, 0, 255))
-        frame_pos = template_details.frame_pos
-        start_x = frame_pos[0] + 10
-        start_y = frame_pos[3] - AVATAR_SIZE - 30
+        album_art = template_details.album_art.image(honorable_song(honorable))
+        start_x, start_y = template_details.layout.anchors["album_art"]
 
         draw = ImageDraw.Draw(panel)
-        panel.paste(album_art, (start_x, start_y))
+        panel.paste(album_art, (start_x, start_y), album_art)
         hm_bbox = draw.textbbox((0, 0),
                                 "Honorable Mention",
                                 font=template_details.fonts["song"])
@@ -365,17 +501,10 @@ def write_honorables(
 
 def clean_name(name: str) -> str:
     name = re.sub(r'\d+', '', name)
-    font = ImageFont.truetype("Fonts/antipasto.regular.ttf", size=30)
-    name_length = font.getlength(name)
-    while (name_length > AVATAR_SIZE):
-        decrease = AVATAR_SIZE / name_length
-        num_char = len(name)
-        name = name[:int(num_char * decrease)]
-        name_length = font.getlength(name)
-    return name
+    return truncate_to_width(name, get_font("Fonts/antipasto.regular.ttf", 30), AVATAR_SIZE)
 
 
-def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> dict:
+def get_columns(header: tuple) -> dict:
     index_dict = {
         'year': None,
         "season": None,
@@ -410,8 +539,7 @@ def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> dict:
         ("honorary", "honorables"),
     ]
 
-    for index, cell in enumerate(sheet[1]):
-        column = cell.value
+    for index, column in enumerate(header):
         if column:
             if column.lower() in ['song info', 'songinfo', 'songartist', "song name", "songname"]:
                 if index_dict["song_info"] is None:
@@ -426,17 +554,94 @@ def get_columns(sheet: openpyxl.worksheet.worksheet.Worksheet) -> dict:
     return index_dict
 
 
-def create_all_panels(sheet_name: str, save_path: str) -> None:
-    wrkbk = openpyxl.load_workbook(sheet_name)
-    sheet = wrkbk.active
-    indices_info = get_columns(sheet)
-    template_details = PanelInfo(indices_info, save_path, "Potato")
-    template_panel = create_template(template_details)
-    for index, row in enumerate(sheet.iter_rows(min_row=2, values_only=True)):
+def row_hash(row: tuple, assets: str, album_art: Optional[tuple]) -> str:
+    return hashlib.sha1(repr((assets, row, album_art)).encode()).hexdigest()
+
+
+# Per-process state for --workers. The template comes from the cache the main process filled
+worker_state = None
+
+
+def init_worker(indices_info: dict, save_path: str, host: str, album_art: dict, profile: bool) -> None:
+    global worker_state
+    profiler.start_worker(profile)
+    # Songs were already matched to album art by the main process
+    template_details = PanelInfo(indices_info, save_path, host, album_art)
+    # Workers already run side by side, so each one writes its panels itself
+    template_details.writer = PanelWriter(threads=0)
+    worker_state = (template_details, load_template(template_details))
+
+
+def render_row(row: tuple) -> list:
+    """Renders a row in a worker and hands its profiler events back to the main process"""
+    template_details, template_panel = worker_state
+    with profiler.stage("render"):
+        create_song_panel(row, template_details, template_panel)
+    return profiler.drain()
+
+
+def create_all_panels(sheet_name: str, save_path: str, host: str = HOST_NAME,
+                      workers: int = 1, force: bool = False) -> None:
+    sheet_rows = iter_sheet_rows(sheet_name, None)
+    rows = profiler.timed(sheet_rows, "workbook load")
+    header = next(rows, ())
+    with profiler.stage("column detection"):
+        indices_info = get_columns(header)
+    # Every row is read before rendering so all missing album art can be reported at once. Seasons sheets are short
+    song_rows = []
+    for index, row in enumerate(rows):
         if row is None or row[0] is None:
             print(f"[INFO] Hit none on row {index + 2}. Exiting")
             break
-        create_song_panel(row, template_details, template_panel)
+        song_rows.append(row)
+    sheet_rows.close()
+    with profiler.stage("template build"):
+        template_details = PanelInfo(indices_info, save_path, host)
+        template_panel = load_template(template_details)
+
+    honorable_column = indices_info["honorables"]
+    honorables = {}
+    if honorable_column is not None:
+        honorables = {index: honorable_song(row[honorable_column])
+                      for index, row in enumerate(song_rows) if row[honorable_column] not in (None, "")}
+    with profiler.stage("album art"):
+        missing = template_details.album_art.match(honorables.values())
+    if missing:
+        print(f"[WARNING] No album art in {HONORABLE_PATH} for {len(missing)} honorable mentions, "
+              f"they get a black square:")
+        for song in missing:
+            print(f"  {song}")
+    # A changed template or panel format re-renders every panel
+    assets = hashlib.sha1(repr((template_key(template_details), template_details.writer.options())).encode()).hexdigest()
+    old_manifest = {} if force else load_manifest(save_path)
+    manifest = {}
+
+    def changed_rows() -> Generator[tuple]:
+        for index, row in enumerate(song_rows):
+            filename = panel_filename(row, indices_info, template_details.writer.extension)
+            album_art = template_details.album_art.stamp(honorables[index]) if index in honorables else None
+            manifest[filename] = row_hash(row, assets, album_art)
+            if old_manifest.get(filename) != manifest[filename] or not os.path.exists(os.path.join(save_path, filename)):
+                yield row
+
+    rendered = 0
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(indices_info, save_path, host, template_details.album_art.matches,
+                                           profiler.enabled)) as pool:
+            for events in pool.map(render_row, changed_rows()):
+                profiler.add(events)
+                rendered += 1
+    else:
+        for row in changed_rows():
+            with profiler.stage("render"):
+                create_song_panel(row, template_details, template_panel)
+            rendered += 1
+    template_details.writer.close()
+    remove_stale_panels(save_path, old_manifest, manifest)
+    save_manifest(save_path, manifest)
+    print(f"[INFO] Rendered {rendered} of {len(manifest)} panels")
 
 
 def create_dirs(sheet_name: str) -> str:
@@ -447,15 +652,30 @@ def create_dirs(sheet_name: str) -> str:
     return save_path
 
 
-def main(sheet_name: str) -> None:
+def main(sheet_name: str, profile: Optional[str] = None, host: str = HOST_NAME,
+         workers: int = 1, force: bool = False) -> None:
     save_path = create_dirs(sheet_name)
     file_path = os.path.join(os.getcwd(), sheet_name)
-    create_all_panels(file_path, save_path)
+    profile_path = trace_path(profile, save_path)
+    profiler.enabled = profile_path is not None
+    create_all_panels(file_path, save_path, host, workers, force)
+    if profile_path:
+        profiler.report()
+        profiler.write_trace(profile_path)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Generate video panels from spreadsheet.')
-    parser.add_argument('sheet', type=str, help='Path to the Excel sheet')
+    parser.add_argument('sheet', type=str, help='Path to the Excel sheet or a CSV export of it')
+    parser.add_argument('--host', type=str, default=HOST_NAME,
+                        help='Name shown next to the frame, with the avatar of the same name')
+    parser.add_argument("-w", '--workers', type=int, default=1,
+                        help='Number of processes to render panels with. 1 renders serially')
+    parser.add_argument("-f", '--force', action="store_true",
+                        help='Re-render every panel even if its row has not changed since the last run')
+    parser.add_argument('--profile', type=str, nargs='?', const='', default=None,
+                        help='Time each stage, print a table and write a Chrome trace to this path, '
+                             'or profile_trace.json in the panels folder')
     args = parser.parse_args()
-    main(args.sheet)
+    main(args.sheet, args.profile, args.host, args.workers, args.force)
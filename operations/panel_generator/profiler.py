@@ -0,0 +1,103 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+from collections.abc import Generator, Iterable
+
+# Set to a trace file path (or empty for the default) to profile without passing --profile
+PROFILE_ENV = "PANEL_PROFILE"
+TRACE_NAME = "profile_trace.json"
+
+_DONE = object()
+
+
+class Profiler:
+    """Records how long each named stage takes. Stages can nest (glow inside user info).
+    Does nothing until enabled, so the stage blocks can stay in the rendering code"""
+    def __init__(self):
+        self.enabled = False
+        self.events: list[tuple[str, float, float, int, int]] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # list.append is atomic, so the panel writer threads can record into the same list
+            self.events.append((name, start, time.perf_counter() - start, os.getpid(), threading.get_ident()))
+
+    def timed(self, iterable: Iterable, name: str) -> Generator:
+        """Yields from iterable, timing every step as the stage name"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def drain(self) -> list[tuple[str, float, float, int, int]]:
+        """Hands over and forgets the events recorded so far, for worker processes to send back with their results"""
+        events, self.events = self.events, []
+        return events
+
+    def start_worker(self, enabled: bool) -> None:
+        """Call first thing in a worker process. A forked worker starts with a copy of the main process's events,
+        which the main process already has, so they are dropped rather than sent back with the first result"""
+        self.events = []
+        self.enabled = enabled
+
+    def add(self, events: Iterable[tuple[str, float, float, int, int]]) -> None:
+        self.events.extend(events)
+
+    def summary(self) -> dict[str, dict]:
+        """Calls, total and longest seconds per stage, slowest stage first"""
+        totals = {}
+        for name, _, duration, _, _ in self.events:
+            stage = totals.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+            stage["calls"] += 1
+            stage["total"] += duration
+            stage["max"] = max(stage["max"], duration)
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["total"]))
+
+    def report(self) -> None:
+        if not self.events:
+            return
+        print("[INFO] Time per stage (nested stages are included in their parent)")
+        print(f"{'Stage':<20}{'Calls':>7}{'Total (s)':>11}{'Mean (ms)':>11}{'Max (ms)':>10}")
+        for name, stage in self.summary().items():
+            print(f"{name:<20}{stage['calls']:>7}{stage['total']:>11.3f}"
+                  f"{stage['total'] / stage['calls'] * 1000:>11.2f}{stage['max'] * 1000:>10.2f}")
+
+    def write_trace(self, path: str) -> None:
+        """Writes the events in Chrome's trace event format, for chrome://tracing or ui.perfetto.dev"""
+        if not self.events:
+            return
+        # perf_counter is the same clock in every process, so worker events line up with the main process
+        origin = min(start for _, start, _, _, _ in self.events)
+        trace = [
+            {"name": name, "ph": "X", "ts": (start - origin) * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid}
+            for name, start, duration, pid, tid in self.events
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        print(f"[INFO] Wrote profile trace to {path}")
+
+
+profiler = Profiler()
+
+
+def trace_path(profile: Optional[str], save_path: str) -> Optional[str]:
+    """Where to write the trace, or None when not profiling. A bare --profile writes it next to the panels"""
+    path = profile
+    if path is None:
+        path = os.environ.get(PROFILE_ENV)
+    if path is None:
+        return None
+    return path or os.path.join(save_path, TRACE_NAME)
@@ -0,0 +1,66 @@
+import csv
+import math
+import os
+from typing import Optional
+from collections.abc import Generator
+import openpyxl
+
+
+def iter_sheet_rows(path: str, index: Optional[int] = 0) -> Generator[tuple]:
+    """Streams the values of every row in a sheet, header included, without loading the whole workbook.
+    index picks the worksheet, None being the active one. CSV exports are read as a workbook with a single sheet.
+    Rows are padded with None to the width of the header"""
+    if os.path.splitext(path)[1].lower() == ".csv":
+        if index not in (0, None):
+            raise ValueError(f"{path} is a CSV file and only has sheet 0, not sheet {index}")
+        rows = _iter_csv_rows(path)
+    else:
+        rows = _iter_workbook_rows(path, index)
+
+    width = None
+    for row in rows:
+        if width is None:
+            width = len(row)
+        elif len(row) < width:
+            row = row + (None,) * (width - len(row))
+        yield row
+
+
+def read_header(path: str, index: Optional[int] = 0) -> tuple:
+    rows = iter_sheet_rows(path, index)
+    try:
+        return next(rows, ())
+    finally:
+        rows.close()
+
+
+def _iter_workbook_rows(path: str, index: Optional[int]) -> Generator[tuple]:
+    wrkbk = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = wrkbk.active if index is None else wrkbk.worksheets[index]
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        # Read-only workbooks keep the file open until closed
+        wrkbk.close()
+
+
+def _iter_csv_rows(path: str) -> Generator[tuple]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.reader(f):
+            yield tuple(_csv_value(value) for value in row)
+
+
+def _csv_value(value: str):
+    """Converts a CSV cell to what openpyxl would have returned for it"""
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    # Keeps names like "Nan" or "Infinity" as text
+    return number if math.isfinite(number) else value